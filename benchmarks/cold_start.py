@@ -0,0 +1,128 @@
+"""
+Measures cold starts in fresh interpreters: the time to import index, to
+answer a first routed request, to create the S3 client and to render a first
+page against StubS3, with the modules imported during each phase.
+
+    python -m benchmarks.cold_start [--runs 5] [--top 10]
+
+Creating the client needs boto3 and a region, but makes no S3 calls.
+"""
+import argparse, json, os, statistics, subprocess, sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASE_MARKER = 'phase: '
+
+# Runs in the child interpreter, which reports its phases on stdout
+CHILD = f"""
+import json, sys, time
+
+def phase(name):
+    sys.stderr.write({PHASE_MARKER!r} + name + '\\n')
+    sys.stderr.flush()
+    return time.perf_counter()
+
+timings = {{}}
+start = phase('import index')
+import index
+timings['import index'] = time.perf_counter() - start
+
+event = {{'pathParameters': {{'proxy': 'password'}}, 'queryStringParameters': {{'password': ''}}, 'headers': {{}}}}
+start = phase('first routed response')
+index.handler(event, None)
+timings['first routed response'] = time.perf_counter() - start
+
+start = phase('S3 client')
+import env
+env.get_s3_client()
+timings['S3 client'] = time.perf_counter() - start
+
+phase('setup')
+from benchmarks.stub_s3 import StubS3
+stub = StubS3()
+stub.put(env.INDEX + '/24-1/Show/OP 1 FULL Song.mp3', b'')
+stub.put(env.INDEX + '/24-1/Show/metadata.json', b'{{}}')
+env.s3_client = stub
+event = {{'pathParameters': {{'proxy': env.INDEX + '/24-1/Show'}}, 'headers': {{'Cookie': 'Signed-In=true', 'Accept-Encoding': 'gzip'}}}}
+
+start = phase('first page')
+index.handler(event, None)
+timings['first page'] = time.perf_counter() - start
+
+print(json.dumps(timings))
+"""
+
+def child_env() -> dict[str, str]:
+    environ = dict(os.environ)
+    environ.setdefault('PLAYER_BUCKET', 'benchmark-bucket')
+    environ.setdefault('PLAYER_URL', 'https://example-website.com/player')
+    environ.setdefault('PLAYER_INDEX', 'index')
+    environ.setdefault('PLAYER_IMAGES', 'https://example-website.com/images')
+    environ.setdefault('PLAYER_PASSWORD', 'benchmark')
+    environ.setdefault('PLAYER_METRICS_SAMPLE', '0')
+    environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    return environ
+
+def parse_imports(stderr: str) -> dict[str, dict[str, float]]:
+    """
+    Returns the cumulative import time in seconds of each top-level import and
+    of the modules it imports directly, grouped by the phase that triggered it.
+    """
+    imports: dict[str, dict[str, float]] = defaultdict(dict)
+    phase = 'startup'
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER):]
+            continue
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented by two spaces per level below the module that imported them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 1 or not cumulative.strip().isdigit():
+            continue
+        imports[phase][name.strip()] = int(cumulative) / 1e6
+    return imports
+
+def run_once() -> tuple[dict[str, float], dict[str, dict[str, float]]]:
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    return json.loads(result.stdout.splitlines()[-1]), parse_imports(result.stderr)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    imports: dict[str, dict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+    for _ in range(args.runs):
+        run_timings, run_imports = run_once()
+        for phase, seconds in run_timings.items():
+            timings[phase].append(seconds)
+        for phase, modules in run_imports.items():
+            for name, seconds in modules.items():
+                imports[phase][name].append(seconds)
+
+    print(f"{'phase':<24} {'median ms':>10}")
+    for phase, values in timings.items():
+        print(f"{phase:<24} {statistics.median(values) * 1000:>10.2f}")
+
+    for phase in timings:
+        modules = sorted(
+            [(statistics.median(values), name) for name, values in imports[phase].items()],
+            reverse=True,
+        )
+        if not modules:
+            continue
+        print(f"\nimported during {phase}:")
+        for seconds, name in modules[:args.top]:
+            print(f"  {name:<28} {seconds * 1000:>8.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Runs index.handler in-process against StubS3 loaded with a synthetic library,
+and reports latency, S3 calls and body sizes per scenario.
+
+    python -m benchmarks.handler [--seasons 8] [--shows 12] [--songs 6]
+        [--requests 200] [--latency-ms 0] [--cold] [--catalog] [--local DIR]
+
+--cold clears the per-container caches before each request, --latency-ms adds
+a fixed delay to each stubbed S3 call, --catalog uploads a catalog manifest
+before running, and --local writes the library to DIR and serves it with
+LocalStorage instead.
+"""
+import argparse, base64, gzip, json, os, time
+from collections import Counter
+
+os.environ.setdefault('PLAYER_BUCKET', 'benchmark-bucket')
+os.environ.setdefault('PLAYER_URL', 'https://example-website.com/player')
+os.environ.setdefault('PLAYER_INDEX', 'index')
+os.environ.setdefault('PLAYER_IMAGES', 'https://example-website.com/images')
+os.environ.setdefault('PLAYER_PASSWORD', 'benchmark')
+os.environ.setdefault('PLAYER_METRICS_SAMPLE', '0')
+
+from env import INDEX
+import env, utils, entries, seasons, catalog, page
+import index as player
+from storage import LocalStorage
+from benchmarks.stub_s3 import StubS3
+
+def synthetic_library(stub: StubS3, season_count: int, show_count: int, song_count: int) -> dict[str, str]:
+    """
+    Fills the stub with seasons of shows of songs, each show with a
+    metadata.json holding lyrics for every song. Returns a path per scenario.
+    """
+    year, season = 24, 4
+    first_show = first_song = first_season = ''
+    for s in range(season_count):
+        season_path = f'{INDEX}/{year}-{season}'
+        first_season = first_season or season_path
+        for n in range(show_count):
+            show_path = f'{season_path}/Show {s}-{n}'
+            song_metadata = {}
+            for i in range(song_count):
+                kind = 'OP' if i % 2 == 0 else 'ED'
+                name = f'Song {s}-{n}-{i}'
+                key = f'{show_path}/{kind} {i // 2 + 1} FULL {name}.mp3'
+                stub.put(key, b'\0' * 64)
+                first_song = first_song or key
+                text = '\n\n'.join(['\n'.join([f'Line {v}-{l} of {name}' for l in range(4)]) for v in range(6)])
+                song_metadata[name] = {'lyrics': {'kanji': {'text': text, 'timing': list(range(0, 24000, 1000))}}}
+            metadata = {
+                'songMetadata': song_metadata,
+                'folderMetadata': {'nextCour': f'{season_path}/Show {s}-{(n + 1) % show_count}'},
+            }
+            stub.put(f'{show_path}/metadata.json', json.dumps(metadata).encode('utf-8'))
+            first_show = first_show or show_path
+        season -= 1
+        if season == 0:
+            year, season = year - 1, 4
+
+    return {
+        'index': INDEX,
+        'season': first_season,
+        'show': first_show,
+        'song': first_song,
+    }
+
+def install(stub: StubS3):
+    env.s3_client = stub
+
+def install_local(stub: StubS3, root: str):
+    for key, (body, _) in stub.objects.items():
+        local_path = os.path.join(root, key)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as local_file:
+            local_file.write(body)
+    catalog.storage = page.storage = LocalStorage(root)
+
+def reset_caches():
+    utils.resolved_paths.clear()
+    utils.metadata_cache.clear()
+    utils.presigned_urls.clear()
+    entries.fragment_cache.clear()
+    entries.season_grid = entries.SeasonGrid()
+    page.lyrics_cache.clear()
+    seasons.season_index.loaded_at = None
+    catalog.current = None
+    catalog.checked_at = None
+    if isinstance(catalog.storage, LocalStorage):
+        catalog.storage.metadata.clear()
+
+def make_event(path: str, hx: bool) -> dict:
+    # Only gzip, which is always available, so that results don't depend on the installed encoders
+    headers = {'Cookie': 'Signed-In=true', 'Accept-Encoding': 'gzip'}
+    if hx:
+        headers['Hx-Request'] = 'true'
+    return {'pathParameters': {'proxy': path}, 'headers': headers, 'queryStringParameters': {}}
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def run_scenario(stub: StubS3, path: str, hx: bool, requests: int, cold: bool) -> dict:
+    durations = []
+    calls: Counter[str] = Counter()
+    rendered = compressed = 0
+    for _ in range(requests):
+        if cold:
+            reset_caches()
+        stub.calls.clear()
+        event = make_event(path, hx)
+        start = time.perf_counter()
+        response = player.handler(event, None)
+        durations.append(time.perf_counter() - start)
+        calls += stub.calls
+
+        body = response.get('body', '')
+        if response.get('isBase64Encoded'):
+            data = base64.b64decode(body)
+            compressed = len(data)
+            if response['headers'].get('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            rendered = len(data)
+        else:
+            rendered = compressed = len(body.encode('utf-8'))
+
+    durations.sort()
+    return {
+        'p50_ms': percentile(durations, 0.50) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        's3_calls': {operation: count / requests for operation, count in sorted(calls.items())},
+        'rendered_bytes': rendered,
+        'compressed_bytes': compressed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seasons', type=int, default=8)
+    parser.add_argument('--shows', type=int, default=12)
+    parser.add_argument('--songs', type=int, default=6)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--cold', action='store_true')
+    parser.add_argument('--catalog', action='store_true')
+    parser.add_argument('--local', metavar='DIR')
+    args = parser.parse_args()
+
+    stub = StubS3()
+    paths = synthetic_library(stub, args.seasons, args.shows, args.songs)
+    install(stub)
+    if args.local:
+        install_local(stub, args.local)
+    elif args.catalog:
+        catalog.upload_catalog(catalog.build_catalog())
+    stub.latency = args.latency_ms / 1000
+
+    scenarios = [
+        ('index', paths['index'], False),
+        ('season', paths['season'], False),
+        ('show', paths['show'], False),
+        ('song', paths['song'], False),
+        ('hx-fragment', paths['show'], True),
+    ]
+    print(f"{'scenario':<12} {'p50 ms':>8} {'p99 ms':>8} {'rendered':>9} {'compressed':>10}  S3 calls per request")
+    for name, path, hx in scenarios:
+        reset_caches()
+        result = run_scenario(stub, path, hx, args.requests, args.cold)
+        calls = ', '.join([f'{operation}={count:g}' for operation, count in result['s3_calls'].items()])
+        print(
+            f"{name:<12} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+            f" {result['rendered_bytes']:>9} {result['compressed_bytes']:>10}  {calls or '-'}"
+        )
+
+if __name__ == '__main__':
+    main()
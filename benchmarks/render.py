@@ -0,0 +1,114 @@
+"""
+Micro-benchmark of folder rendering against the previous per-entry regex and
+nested f-string renderer, on a synthetic show folder.
+
+    python -m benchmarks.render [entries] [repeat]
+"""
+import os, re, sys, timeit, urllib.parse
+
+os.environ.setdefault('PLAYER_URL', 'https://example-website.com/player')
+os.environ.setdefault('PLAYER_INDEX', 'index')
+
+from env import URL, INDEX
+from entries import render_folder_contents, badge, display_music_exts, music_order
+
+def synthetic_folder(path: str, count: int) -> list[str]:
+    keys = []
+    for i in range(count):
+        match i % 5:
+            case 0: keys.append(f'{path}/OP {i} FULL Opening Song {i}.mp3')
+            case 1: keys.append(f'{path}/ED FULL Ending Song {i}.m4a')
+            case 2: keys.append(f'{path}/Insert Song {i} (TV Size).mp3')
+            case 3: keys.append(f'{path}/Cover {i}.jpg')
+            case 4: keys.append(f'{path}/Part {i}/')
+    return keys
+
+def legacy_entry_element(path, label, is_file, liClassName: str = ''):
+    encoded_path = '/'.join([
+        urllib.parse.quote(component) for component in os.path.normpath(path).split('/')
+    ]) + ('/' if path.endswith('/') else '')
+    return f"""\
+    <li
+        class="flex items-center gap-2 bg-slate-700 p-2
+        rounded-md{f' {liClassName}' if liClassName else ''}"
+    >
+        <a
+            href="{URL}/{encoded_path}"
+            {f'hx-push-url="{URL}/{encoded_path}"' if not is_file else ''}
+            hx-swap="none"
+            {f'hx-on::before-request="trackClicked(\'{
+                os.path.splitext(path)[0].replace(f'{INDEX}/', '')
+            }\')"' if is_file else ''}
+            class="self-stretch flex-1 flex gap-2 justify-center items-center bg-slate-600 rounded-md
+            p-1 px-2 text-sm hover:bg-slate-500 focus:bg-slate-500 cursor-pointer"
+        >{label}</a>
+        {f"""\
+        <button
+            class="flex justify-center items-center
+            bg-slate-600 rounded-md active:bg-slate-500 transition-all"
+            style="padding:0.125rem;min-width:2.5rem;min-height:2.5rem"
+            onclick="addToPlaylist('{encoded_path}')"
+        >
+            <span
+                data-display="flex"
+                class="material-symbols-outlined flex justify-center items-center"
+                style="display:none;min-height:2rem"
+            >playlist_add</span>
+        </button>
+        <button
+            class="flex justify-center items-center
+            bg-slate-600 rounded-md active:bg-slate-500 transition-all"
+            style="padding:0.125rem;min-width:2.5rem;min-height:2.5rem"
+            onclick="viewLyrics('{encoded_path}')"
+        >
+            <span
+                data-display="flex"
+                class="material-symbols-outlined flex justify-center items-center"
+                style="display:none;min-height:2rem"
+            >lyrics</span>
+        </button>""" if is_file else ''}
+    </li>"""
+
+def legacy_render(path: str, keys: list[str]) -> str:
+    file_entries = []
+    for key in sorted(keys, key=music_order):
+        parent = os.path.dirname(key.rstrip('/')) + '/'
+        name, ext = os.path.splitext(key.replace(parent, '').rstrip('/'))
+
+        if name_match := re.match(r"(OP|ED) ?(\d+)? FULL ?(.*)", name):
+            number = f"&nbsp;{name_match.group(2)}" if name_match.group(2) else ""
+            label = ''.join([
+                f"{badge(f"{name_match.group(1)}{number}")}",
+                f'<span class="flex-1 text-center">{name_match.group(3)}</span>'
+            ])
+        else:
+            label = re.sub(r"(OP|ED) ?(\d+)? FULL ?", badge(r"\1&nbsp;\2"), name)
+            label = label.replace('FULL ', '')
+
+        if ext != '' and ext not in display_music_exts:
+            continue
+
+        file_entries.append(legacy_entry_element(f'{parent}{name}{ext}', label, ext != ''))
+    return '\n'.join(file_entries)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    path = f'{INDEX}/24-1/Synthetic Show'
+    keys = synthetic_folder(path, count)
+
+    def run_legacy():
+        legacy_render(path, keys)
+
+    def run_current():
+        render_folder_contents(None, path, keys)
+
+    legacy = min(timeit.repeat(run_legacy, number=1, repeat=repeat))
+    current = min(timeit.repeat(run_current, number=1, repeat=repeat))
+    print(f'{count} entries, best of {repeat}')
+    print(f'legacy:  {legacy * 1000:8.2f} ms')
+    print(f'current: {current * 1000:8.2f} ms')
+    print(f'speedup: {legacy / current:8.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+Replays a corpus of recorded API Gateway events against index.handler
+in-process, at each of a series of concurrency levels, and reports the
+throughput, tail latencies and time per phase at each level. Exits with
+status 1 when a result crosses a limit in the thresholds.json next to the
+corpus.
+
+    python -m benchmarks.replay run CORPUS [--concurrency 1,4,16] [--requests 500]
+        [--rate 0] [--processes] [--warmup 0] [--synthetic] [--latency-ms 0]
+        [--local DIR] [--json PATH] [--baseline PATH]
+    python -m benchmarks.replay scrub EVENTS... --corpus CORPUS
+
+A corpus is a directory holding events.jsonl, one event per line, and
+optionally thresholds.json. `scrub` appends events to it from JSON files of
+an event, a list of events or JSON lines, with their cookies, passwords and
+client addresses removed.
+
+--rate sets the total requests per second, with latency measured from when
+each request was due, so that queueing behind slow requests is counted;
+without it each worker sends its next request as soon as the last one ends.
+--processes runs each worker in its own process with its own caches, like
+separate Lambda containers, instead of on threads sharing one process like
+server.py. --warmup sends that many events through each process before
+timing starts.
+
+--synthetic serves the library of benchmarks.handler from StubS3, which is
+what benchmarks/corpus was recorded against, and --local DIR writes that
+library to DIR and serves it with LocalStorage. Otherwise the library is
+the one that PLAYER_BUCKET or PLAYER_LOCAL_ROOT configures.
+
+Timings depend on the machine, so their limits are relative to a baseline:
+the --json report of an earlier run on the same machine, e.g. of the base
+commit, given with --baseline. thresholds.json holds limits for every level,
+with overrides per level:
+
+    {"max_error_rate": 0, "max_ratio": {"p50_ms": 1.5, "p99_ms": 2},
+     "min_rps_ratio": 0.7, "phase_p99_ratio": {"compress": 2}, "noise_ms": 1,
+     "concurrency": {"16": {"min_rps_ratio": 0.8}}}
+
+A timing fails when it is over its ratio of the baseline and also more
+than noise_ms (default 1) away from it, so that sub-millisecond phases
+don't fail on jitter. Without a baseline only max_error_rate is checked.
+"""
+import argparse, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import cookies
+from typing import Any
+
+EVENTS_FILE = 'events.jsonl'
+THRESHOLDS_FILE = 'thresholds.json'
+# Headers that carry credentials or client addresses, dropped by scrub
+SECRET_HEADERS = {'authorization', 'x-api-key', 'x-forwarded-for', 'forwarded', 'x-real-ip'}
+# Milliseconds that a timing may differ from the baseline by before its ratio is checked
+NOISE_MS = 1.0
+
+events: list[dict[str, Any]] = []
+raw_handler = None
+
+def scrub_cookie(header: str) -> str | None:
+    """Keeps only whether the request was signed in."""
+    C = cookies.SimpleCookie()
+    try:
+        C.load(header)
+    except cookies.CookieError:
+        return None
+    signed_in = C.get('Signed-In')
+    return 'Signed-In=true' if signed_in and signed_in.value else None
+
+def scrub_event(event: dict[str, Any]) -> dict[str, Any]:
+    event = json.loads(json.dumps(event))
+    for headers_name in ('headers', 'multiValueHeaders'):
+        headers: dict[str, Any] = event.get(headers_name) or {}
+        for name in list(headers):
+            if name.lower() in SECRET_HEADERS:
+                del headers[name]
+            elif name.lower() == 'cookie':
+                values = headers[name] if isinstance(headers[name], list) else [headers[name]]
+                scrubbed = [cookie for value in values if (cookie := scrub_cookie(value))]
+                if not scrubbed:
+                    del headers[name]
+                else:
+                    headers[name] = scrubbed if isinstance(headers[name], list) else scrubbed[0]
+
+    # The password route takes the player password as a query parameter
+    for query_name in ('queryStringParameters', 'multiValueQueryStringParameters'):
+        query: dict[str, Any] = event.get(query_name) or {}
+        if 'password' in query:
+            query['password'] = [''] if isinstance(query['password'], list) else ''
+
+    # Client addresses and identities
+    if (event.get('requestContext') or {}).get('identity'):
+        event['requestContext']['identity'] = {}
+    return event
+
+def read_events(path: str) -> list[dict[str, Any]]:
+    with open(path) as events_file:
+        text = events_file.read()
+    try:
+        loaded = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return loaded if isinstance(loaded, list) else [loaded]
+
+def scrub(paths: list[str], corpus: str):
+    os.makedirs(corpus, exist_ok=True)
+    scrubbed = [scrub_event(event) for path in paths for event in read_events(path)]
+    with open(os.path.join(corpus, EVENTS_FILE), 'a') as events_file:
+        for event in scrubbed:
+            events_file.write(json.dumps(event, separators=(',', ':'), ensure_ascii=False) + '\n')
+    print(f"Appended {len(scrubbed)} events to {os.path.join(corpus, EVENTS_FILE)}")
+
+def setup(corpus: str, synthetic: bool, latency_ms: float, local: str | None, warmup: int):
+    """
+    Loads the corpus and the handler, and warms its caches with the first
+    `warmup` events, in the parent or in each worker process.
+    """
+    global raw_handler
+    events[:] = read_events(os.path.join(corpus, EVENTS_FILE))
+
+    if synthetic or local:
+        from benchmarks.handler import StubS3, synthetic_library, install, install_local
+        stub = StubS3()
+        synthetic_library(stub, 8, 12, 6)
+        install(stub)
+        if local:
+            install_local(stub, local)
+        stub.latency = latency_ms / 1000
+
+    import index
+    # Timed here instead of by metrics.instrument, which would print a line per request
+    raw_handler = index.handler.__wrapped__
+    for i in range(warmup):
+        invoke(events[i % len(events)])
+
+def invoke(event: dict[str, Any]) -> tuple[int, dict[str, float]]:
+    import metrics
+    request_metrics = metrics.RequestMetrics()
+    token = metrics.current_metrics.set(request_metrics)
+    try:
+        status = raw_handler(event, None).get('statusCode', 0)
+    except Exception:
+        status = 0
+    finally:
+        metrics.current_metrics.reset(token)
+    return status, request_metrics.durations
+
+def run_worker(
+    worker: int, workers: int, requests: int, rate: float, start_at: float,
+) -> list[tuple[float, float, int, dict[str, float]]]:
+    """
+    Sends every `workers`-th request of the run, starting with request
+    `worker`, and returns the (due offset, latency, status, phase seconds) of
+    each. Times are wall-clock, so that they line up across processes.
+    """
+    time.sleep(max(0.0, start_at - time.time()))
+    results = []
+    for i in range(worker, requests, workers):
+        due = start_at + i / rate if rate else time.time()
+        if (wait := due - time.time()) > 0:
+            time.sleep(wait)
+        status, phases = invoke(events[i % len(events)])
+        results.append((due - start_at, time.time() - due, status, phases))
+    return results
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(concurrency: int, results: list[tuple[float, float, int, dict[str, float]]]) -> dict[str, Any]:
+    latencies = sorted([latency for _, latency, _, _ in results])
+    elapsed = max(due + latency for due, latency, _, _ in results)
+    errors = sum(1 for _, _, status, _ in results if status == 0 or status >= 500)
+
+    phase_times: dict[str, list[float]] = {}
+    for _, _, _, phases in results:
+        for name, seconds in phases.items():
+            phase_times.setdefault(name, []).append(seconds)
+    phases = {}
+    for name, times in phase_times.items():
+        times.sort()
+        # Requests without the phase count as spending no time in it
+        times[:0] = [0.0] * (len(results) - len(times))
+        phases[name] = {
+            'mean_ms': sum(times) / len(results) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+        }
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'rps': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'p999_ms': percentile(latencies, 0.999) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'error_rate': errors / len(results),
+        'phases': dict(sorted(phases.items(), key=lambda item: -item[1]['mean_ms'])),
+    }
+
+def run_level(args, concurrency: int) -> dict[str, Any]:
+    # Leaves the workers time to start, and processes time to warm up, before the first request is due
+    start_at = time.time() + (2.0 if args.processes else 0.1)
+    calls = [
+        (worker, concurrency, args.requests, args.rate, start_at)
+        for worker in range(concurrency)
+    ]
+    if args.processes:
+        with ProcessPoolExecutor(
+            max_workers=concurrency, initializer=setup,
+            initargs=(args.corpus, args.synthetic, args.latency_ms, args.local, args.warmup),
+        ) as executor:
+            futures = [executor.submit(run_worker, *call) for call in calls]
+            results = [result for future in futures for result in future.result()]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run_worker, *call) for call in calls]
+            results = [result for future in futures for result in future.result()]
+    return summarize(concurrency, results)
+
+def check_thresholds(
+    thresholds: dict[str, Any], levels: list[dict[str, Any]], baseline: dict[int, dict[str, Any]],
+) -> list[str]:
+    """
+    Returns a message for each limit that a level crossed. Timings are only
+    checked for the levels that the baseline has.
+    """
+    failures = []
+    for level in levels:
+        limits = {**thresholds, **thresholds.get('concurrency', {}).get(str(level['concurrency']), {})}
+        prefix = f"concurrency {level['concurrency']}:"
+        if 'max_error_rate' in limits and level['error_rate'] > limits['max_error_rate']:
+            failures.append(f"{prefix} error rate {level['error_rate']:.4f} > {limits['max_error_rate']}")
+
+        if (base := baseline.get(level['concurrency'])) is None:
+            continue
+        noise_ms = limits.get('noise_ms', NOISE_MS)
+
+        def slower(ms: float, base_ms: float, ratio: float) -> bool:
+            return ms > base_ms * ratio and ms - base_ms > noise_ms
+
+        for name, ratio in limits.get('max_ratio', {}).items():
+            if slower(level[name], base[name], ratio):
+                failures.append(f"{prefix} {name} {level[name]:.2f} > {ratio} x baseline {base[name]:.2f}")
+        if 'min_rps_ratio' in limits and level['rps'] < base['rps'] * limits['min_rps_ratio']:
+            failures.append(f"{prefix} rps {level['rps']:.1f} < {limits['min_rps_ratio']} x baseline {base['rps']:.1f}")
+        for phase, ratio in limits.get('phase_p99_ratio', {}).items():
+            phase_p99 = level['phases'].get(phase, {}).get('p99_ms', 0.0)
+            base_p99 = base['phases'].get(phase, {}).get('p99_ms', 0.0)
+            if slower(phase_p99, base_p99, ratio):
+                failures.append(f"{prefix} {phase} p99 {phase_p99:.2f} ms > {ratio} x baseline {base_p99:.2f}")
+    return failures
+
+def read_baseline(path: str | None) -> dict[int, dict[str, Any]]:
+    """Returns the levels of a --json report by concurrency, or none without a path."""
+    if not path:
+        return {}
+    with open(path) as baseline_file:
+        return {level['concurrency']: level for level in json.load(baseline_file)['levels']}
+
+def print_report(levels: list[dict[str, Any]]):
+    print(
+        f"{'workers':>7} {'requests':>8} {'rps':>9} {'p50 ms':>8} {'p90 ms':>8}"
+        f" {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8} {'errors':>7}"
+    )
+    for level in levels:
+        print(
+            f"{level['concurrency']:>7} {level['requests']:>8} {level['rps']:>9.1f}"
+            f" {level['p50_ms']:>8.2f} {level['p90_ms']:>8.2f} {level['p99_ms']:>8.2f}"
+            f" {level['p999_ms']:>9.2f} {level['max_ms']:>8.2f} {level['error_rate']:>7.2%}"
+        )
+
+    print(f"\n{'phase':<24}" + ''.join([f" {f'mean/p99 @{level["concurrency"]}':>18}" for level in levels]))
+    for name in levels[-1]['phases']:
+        cells = []
+        for level in levels:
+            phase = level['phases'].get(name, {'mean_ms': 0.0, 'p99_ms': 0.0})
+            cells.append(f" {f'{phase["mean_ms"]:.2f}/{phase["p99_ms"]:.2f}':>18}")
+        print(f"{name:<24}" + ''.join(cells))
+
+def run(args):
+    thresholds_path = os.path.join(args.corpus, THRESHOLDS_FILE)
+    thresholds = {}
+    if os.path.exists(thresholds_path):
+        with open(thresholds_path) as thresholds_file:
+            thresholds = json.load(thresholds_file)
+
+    baseline = read_baseline(args.baseline)
+    if not baseline:
+        print("No --baseline given, so only the error rate is checked\n")
+
+    if not args.processes:
+        setup(args.corpus, args.synthetic, args.latency_ms, args.local, args.warmup)
+    levels = [run_level(args, int(concurrency)) for concurrency in args.concurrency.split(',')]
+    print_report(levels)
+
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump({'levels': levels}, report_file, indent=2)
+
+    if failures := check_thresholds(thresholds, levels, baseline):
+        print(f"\n{len(failures)} thresholds of {thresholds_path} crossed:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('corpus')
+    run_parser.add_argument('--concurrency', default='1,4,16')
+    run_parser.add_argument('--requests', type=int, default=500)
+    run_parser.add_argument('--rate', type=float, default=0.0)
+    run_parser.add_argument('--processes', action='store_true')
+    run_parser.add_argument('--warmup', type=int, default=0)
+    run_parser.add_argument('--synthetic', action='store_true')
+    run_parser.add_argument('--latency-ms', type=float, default=0.0)
+    run_parser.add_argument('--local', metavar='DIR')
+    run_parser.add_argument('--json', metavar='PATH')
+    run_parser.add_argument('--baseline', metavar='PATH')
+
+    scrub_parser = commands.add_parser('scrub')
+    scrub_parser.add_argument('events', nargs='+')
+    scrub_parser.add_argument('--corpus', required=True)
+
+    args = parser.parse_args()
+    if args.command == 'scrub':
+        scrub(args.events, args.corpus)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+An in-memory stand-in for the parts of the boto3 S3 client that the player
+uses, counting calls per operation and optionally adding a fixed latency.
+"""
+import hashlib, io, time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+def client_error(code: str, status: int, operation: str) -> ClientError:
+    return ClientError(
+        {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation,
+    )
+
+class StubS3:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        # key -> (body, ETag)
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self.calls: Counter[str] = Counter()
+        self._sorted_keys: list[str] | None = None
+
+    def _call(self, operation: str):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _keys(self) -> list[str]:
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self.objects)
+        return self._sorted_keys
+
+    def put(self, key: str, body: bytes):
+        self.objects[key] = (body, f'"{hashlib.md5(body).hexdigest()}"')
+        self._sorted_keys = None
+
+    def put_object(self, Bucket, Key, Body, **_):
+        self._call('put_object')
+        self.put(Key, Body if isinstance(Body, bytes) else Body.encode('utf-8'))
+        return {'ETag': self.objects[Key][1]}
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, MaxKeys=1000, ContinuationToken=None, **_):
+        self._call('list_objects_v2')
+        items: list[tuple[str, bool]] = []
+        seen_prefixes = set()
+        for key in self._keys():
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest.split(Delimiter, 1)[0] + Delimiter
+                if prefix not in seen_prefixes:
+                    seen_prefixes.add(prefix)
+                    items.append((prefix, True))
+            else:
+                items.append((key, False))
+
+        start = int(ContinuationToken or 0)
+        page = items[start:start + MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': start + MaxKeys < len(items),
+        }
+        contents = [
+            {'Key': key, 'ETag': self.objects[key][1], 'Size': len(self.objects[key][0])}
+            for key, is_prefix in page if not is_prefix
+        ]
+        prefixes = [{'Prefix': key} for key, is_prefix in page if is_prefix]
+        if contents:
+            response['Contents'] = contents
+        if prefixes:
+            response['CommonPrefixes'] = prefixes
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def head_object(self, Bucket, Key, **_):
+        self._call('head_object')
+        if Key not in self.objects:
+            raise client_error('404', 404, 'HeadObject')
+        body, etag = self.objects[Key]
+        return {'ETag': etag, 'ContentLength': len(body)}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **_):
+        self._call('get_object')
+        if Key not in self.objects:
+            raise client_error('NoSuchKey', 404, 'GetObject')
+        body, etag = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise client_error('304', 304, 'GetObject')
+        return {'Body': io.BytesIO(body), 'ETag': etag, 'ContentLength': len(body)}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **_):
+        self.calls['generate_presigned_url'] += 1
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Date={time.time_ns()}"
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+class LRUCache:
+    """
+    A thread-safe LRU cache bounded by the total size of its values. Each
+    entry is stored with a version, and a lookup with a different version
+    drops the entry.
+    """
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (version, value, size)
+        self.entries: OrderedDict[Hashable, tuple[Hashable, Any, int]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Hashable = None) -> Any | None:
+        with self.lock:
+            if (entry := self.entries.get(key)) is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, version: Hashable = None):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def delete(self, key: Hashable):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key: Hashable):
+        self.size -= self.entries.pop(key)[2]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'bytes': self.size,
+        }
@@ -0,0 +1,162 @@
+"""
+A manifest of every object in the bucket and every parsed metadata.json, so
+that browsing is answered from memory instead of listing S3 per request.
+
+Rebuild and upload it after changing the library:
+
+    python catalog.py
+
+Until a manifest exists, when PLAYER_CATALOG is empty, or when the library is
+served from PLAYER_LOCAL_ROOT, lookups go to the storage directly.
+"""
+import os, json, gzip, time, threading
+from functools import partial
+from typing import Any, Iterator
+
+from env import CATALOG, CATALOG_CHECK_INTERVAL
+from utils import (
+    ItemType, TransientS3Error, NotModified, FolderListing, Metadata,
+    call_s3, iter_s3_listing, run_concurrently, fingerprint, get_s3_metadata,
+)
+from storage import storage, S3Storage
+
+CATALOG_VERSION = 1
+
+class Catalog:
+    __slots__ = ('etag', 'objects', 'folders', 'metadata')
+
+    def __init__(self, manifest: dict[str, Any], etag: str):
+        self.etag = etag
+        # key -> (size, ETag)
+        self.objects: dict[str, tuple[int, str]] = {
+            key: (size, object_etag) for key, size, object_etag in manifest['objects']
+        }
+        # folder path -> parsed metadata.json
+        self.metadata: dict[str, Metadata] = {}
+        for folder, folder_metadata in manifest['metadata'].items():
+            metadata = self.metadata[folder] = Metadata(folder_metadata)
+            metadata.etag = self.objects.get(f'{folder}/metadata.json', (0, ''))[1]
+
+        # folder path -> keys and sub-folder prefixes, as a delimiter listing returns them
+        folders: dict[str, dict[str, None]] = {}
+        for key in self.objects:
+            folder = os.path.dirname(key)
+            folders.setdefault(folder, {})[key] = None
+            while folder:
+                parent = os.path.dirname(folder)
+                folders.setdefault(parent, {})[folder + '/'] = None
+                folder = parent
+        self.folders: dict[str, FolderListing] = {}
+        for folder, entries in folders.items():
+            listing = self.folders[folder] = FolderListing(sorted(entries))
+            listing.fingerprint = fingerprint(*[
+                part for key in listing for part in (key, self.objects.get(key, (0, ''))[1])
+            ])
+
+    def resolve(self, path: str) -> ItemType:
+        if path in self.objects:
+            return ItemType.FILE
+        if path and path in self.folders:
+            return ItemType.FOLDER
+        return ItemType.MISSING
+
+current: Catalog | None = None
+checked_at: float | None = None
+lock = threading.Lock()
+
+def get_catalog() -> Catalog | None:
+    """
+    Returns the manifest loaded in this container, checking its ETag at most
+    every CATALOG_CHECK_INTERVAL seconds and reloading it only when it changed.
+    """
+    global current, checked_at
+    if not CATALOG or not isinstance(storage, S3Storage):
+        return None
+
+    if checked_at is not None and time.monotonic() - checked_at < CATALOG_CHECK_INTERVAL:
+        return current
+
+    with lock:
+        if checked_at is not None and time.monotonic() - checked_at < CATALOG_CHECK_INTERVAL:
+            return current
+
+        kwargs: dict[str, Any] = {'Key': CATALOG}
+        if current:
+            kwargs['IfNoneMatch'] = current.etag
+        try:
+            if (response := call_s3('get_object', **kwargs)) is None:
+                current = None
+            else:
+                manifest = json.loads(gzip.decompress(response['Body'].read()))
+                if manifest.get('version') == CATALOG_VERSION:
+                    current = Catalog(manifest, response['ETag'])
+        except NotModified:
+            pass
+        except (TransientS3Error, ValueError, OSError):
+            # Keep serving the previous manifest, if any
+            pass
+        checked_at = time.monotonic()
+
+    return current
+
+def get_folder(path: str) -> FolderListing | None:
+    if (catalog := get_catalog()) is None:
+        return storage.get_folder(path)
+    return catalog.folders.get(path)
+
+def get_metadata(path: str) -> Metadata | None:
+    if (catalog := get_catalog()) is None:
+        return storage.get_metadata(path)
+    return catalog.metadata.get(path)
+
+def file_exists(path: str) -> bool:
+    if (catalog := get_catalog()) is None:
+        return storage.file_exists(path)
+    return path in catalog.objects
+
+def resolve(path: str) -> ItemType:
+    if (catalog := get_catalog()) is None:
+        return storage.resolve(path)
+    return catalog.resolve(path)
+
+def iter_objects(prefix: str) -> Iterator[tuple[str, str]]:
+    if (catalog := get_catalog()) is None:
+        yield from storage.iter_objects(prefix)
+        return
+    for key, (_, etag) in catalog.objects.items():
+        if key.startswith(prefix):
+            yield key, etag
+
+def build_catalog() -> dict[str, Any]:
+    objects = []
+    for response in iter_s3_listing('', delimiter=None):
+        for obj in response.get('Contents', []):
+            if obj['Key'] != CATALOG:
+                objects.append([obj['Key'], obj['Size'], obj['ETag']])
+
+    metadata_folders = [
+        os.path.dirname(key) for key, _, _ in objects
+        if os.path.basename(key) == 'metadata.json'
+    ]
+    metadata = run_concurrently(*[partial(get_s3_metadata, folder) for folder in metadata_folders])
+
+    return {
+        'version': CATALOG_VERSION,
+        'objects': objects,
+        'metadata': {
+            folder: folder_metadata
+            for folder, folder_metadata in zip(metadata_folders, metadata)
+            if folder_metadata is not None
+        },
+    }
+
+def upload_catalog(manifest: dict[str, Any]):
+    body = json.dumps(manifest, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    call_s3('put_object', Key=CATALOG, Body=gzip.compress(body), ContentType='application/gzip')
+
+if __name__ == '__main__':
+    if not CATALOG:
+        raise SystemExit("PLAYER_CATALOG is empty.")
+    manifest = build_catalog()
+    upload_catalog(manifest)
+    print(f"Wrote {CATALOG}: {len(manifest['objects'])} objects, {len(manifest['metadata'])} metadata files")
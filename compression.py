@@ -0,0 +1,208 @@
+import struct, zlib
+from typing import Iterable, Iterator
+
+from env import COMPRESS_MIN_SIZE
+import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Levels tuned for latency rather than size
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 4
+
+# Characters of rendered text that a streamed page buffers before compressing and sending them
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Preferred first when the client accepts several with the same q-value
+available_encodings = [
+    *(['zstd'] if zstandard else []),
+    *(['br'] if brotli else []),
+    'gzip',
+]
+
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# An empty final deflate block
+DEFLATE_END = b'\x03\x00'
+
+class Static:
+    """
+    A piece of a page that never changes. It is compressed at most once per
+    encoding per container and spliced into the compressed page as is.
+    """
+    __slots__ = ('text', 'data', 'compressed')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.data = text.encode('utf-8')
+        self.compressed: dict[str, bytes] = {}
+
+    def compress(self, encoding: str) -> bytes:
+        if (data := self.compressed.get(encoding)) is None:
+            data = self.compressed[encoding] = compress_chunk(self.data, encoding)
+        return data
+
+Part = str | Static
+
+def compress_chunk(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses one chunk so that chunks can be concatenated: a byte-aligned,
+    non-final raw deflate segment for gzip, or a complete frame for zstd.
+    """
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    if encoding == 'zstd' and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f'Unsupported chunk encoding: {encoding}')
+
+def negotiate(accept_encoding: str) -> str | None:
+    """
+    Picks the supported encoding with the highest q-value in an
+    Accept-Encoding header, or None to send the body uncompressed.
+    """
+    qualities: dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        if not (name := name.strip().lower()):
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available_encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def join_parts(parts: Iterable[Part]) -> str:
+    return ''.join([part.text if isinstance(part, Static) else part for part in parts])
+
+def compress_parts(parts: list[Part], encoding: str) -> bytes:
+    """
+    Compresses a page. For gzip and zstd, consecutive dynamic parts are
+    compressed together and static parts reuse their precompressed chunks.
+    """
+    if encoding == 'br':
+        return brotli.compress(join_parts(parts).encode('utf-8'), quality=BROTLI_QUALITY)
+
+    chunks: list[bytes] = []
+    crc = 0
+    size = 0
+    pending: list[str] = []
+
+    def flush_pending():
+        nonlocal crc, size
+        if pending:
+            data = ''.join(pending).encode('utf-8')
+            pending.clear()
+            chunks.append(compress_chunk(data, encoding))
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+
+    for part in parts:
+        if isinstance(part, Static):
+            flush_pending()
+            chunks.append(part.compress(encoding))
+            crc = zlib.crc32(part.data, crc)
+            size += len(part.data)
+        elif part:
+            pending.append(part)
+    flush_pending()
+
+    if encoding == 'gzip':
+        return b''.join([
+            GZIP_HEADER,
+            *chunks,
+            DEFLATE_END,
+            struct.pack('<II', crc & 0xffffffff, size & 0xffffffff),
+        ])
+    return b''.join(chunks)
+
+def encode_parts(parts: list[Part], accept_encoding: str) -> tuple[bytes | str, str | None]:
+    """
+    Returns the page compressed with the negotiated encoding, or as text when
+    the client accepts none of them or the page is below COMPRESS_MIN_SIZE.
+    """
+    encoding = negotiate(accept_encoding)
+    size = sum([len(part.data) if isinstance(part, Static) else len(part) for part in parts])
+    metrics.record('rendered_size', size)
+    if encoding is not None and size >= COMPRESS_MIN_SIZE:
+        with metrics.span('compress'):
+            body = compress_parts(parts, encoding)
+        metrics.record('encoding', encoding)
+        metrics.record('compressed_bytes', len(body))
+        return body, encoding
+    return join_parts(parts), None
+
+def stream_parts(parts: Iterable[Part], encoding: str | None) -> Iterator[bytes]:
+    """
+    Yields a page compressed as its parts are rendered. Static parts are
+    sent as their precompressed chunks, and dynamic text is compressed and
+    sent whenever STREAM_CHUNK_SIZE of it is buffered or a static part is
+    reached, so the head of the page is sent while later parts still render.
+    Timings are not recorded, as the request's metrics line is already out.
+    """
+    brotli_compressor = brotli.Compressor(quality=BROTLI_QUALITY) if encoding == 'br' else None
+    crc = 0
+    size = 0
+    pending: list[str] = []
+    pending_size = 0
+
+    def compress(data: bytes) -> bytes:
+        nonlocal crc, size
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        if encoding is None:
+            return data
+        if brotli_compressor:
+            return brotli_compressor.process(data) + brotli_compressor.flush()
+        return compress_chunk(data, encoding)
+
+    def flush_pending() -> bytes:
+        nonlocal pending_size
+        data = ''.join(pending).encode('utf-8')
+        pending.clear()
+        pending_size = 0
+        return compress(data) if data else b''
+
+    if encoding == 'gzip':
+        yield GZIP_HEADER
+    for part in parts:
+        if isinstance(part, Static):
+            if chunk := flush_pending():
+                yield chunk
+            if encoding in ('gzip', 'zstd'):
+                crc = zlib.crc32(part.data, crc)
+                size += len(part.data)
+                yield part.compress(encoding)
+            else:
+                yield compress(part.data)
+        elif part:
+            pending.append(part)
+            pending_size += len(part)
+            if pending_size >= STREAM_CHUNK_SIZE:
+                yield flush_pending()
+    if chunk := flush_pending():
+        yield chunk
+
+    if encoding == 'gzip':
+        yield DEFLATE_END + struct.pack('<II', crc & 0xffffffff, size & 0xffffffff)
+    elif brotli_compressor:
+        yield brotli_compressor.finish()
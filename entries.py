@@ -1,9 +1,13 @@
-import os, re
+import os, re, html, itertools, threading
 from datetime import datetime
-from typing import Any
+from operator import itemgetter
+from typing import Iterable
 
-from env import URL, INDEX
-from utils import season_map, re_season, get_s3_folder, encode_path_components
+from env import URL, INDEX, FRAGMENT_CACHE_SIZE
+from utils import season_map, re_season, encode_path_components
+from cache import LRUCache
+import metrics
+from seasons import season_index, to_period, format_period
 
 display_music_exts = ['.mp3', '.m4a']
 arrow_classes = "material-symbols-outlined flex justify-center items-center"
@@ -16,8 +20,43 @@ current_season = (now.month - 1) // 3
 period_min = 13*4 + 1
 period_max = current_year*4 + current_season
 
-def display_folder_contents(metadata, path: str, response) -> str:
-    if not (path_match := re.search(r"^[\w_-]+(?:\/(\d{2}-[1-4]))?(?:\/([^/]+))?", path)):
+re_folder_path = re.compile(r"^[\w_-]+(?:\/(\d{2}-[1-4]))?(?:\/([^/]+))?")
+re_season_compiled = re.compile(re_season)
+re_season_folder = re.compile(rf"{re.escape(INDEX)}/{re_season}/")
+re_song = re.compile(r"(OP|ED) ?(\d+)? FULL ?(.*)")
+re_song_badge = re.compile(r"(OP|ED) ?(\d+)? FULL ?")
+
+# path -> rendered folder, versioned by the fingerprints of its inputs
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE)
+
+def display_folder_contents(metadata, path: str, entries: Iterable[str]) -> str:
+    """
+    Renders a folder, reusing the last rendering of the path while its
+    listing, metadata.json and the season index are unchanged.
+    """
+    with metrics.span('display_folder_contents'):
+        if not (listing_fingerprint := getattr(entries, 'fingerprint', '')):
+            return render_folder_contents(metadata, path, entries)
+
+        version = (
+            listing_fingerprint,
+            metadata.etag if metadata else '',
+            season_index.get_fingerprint(),
+        )
+        if (content := fragment_cache.get(path, version)) is None:
+            metrics.count('fragment_cache.miss')
+            content = render_folder_contents(metadata, path, entries)
+            fragment_cache.set(path, content, version)
+        else:
+            metrics.count('fragment_cache.hit')
+        return content
+
+def render_folder_contents(metadata, path: str, entries: Iterable[str]) -> str:
+    """
+    Renders a folder from its keys and prefixes in a single pass. Each entry
+    is rendered as it is read and only the rendered rows are kept for sorting.
+    """
+    if not (path_match := re_folder_path.search(path)):
         return ''
  
     season = path_match.group(1)
@@ -26,76 +65,43 @@ def display_folder_contents(metadata, path: str, response) -> str:
     file_entries = []
 
     add_season_navigation(path, file_entries, season, show)
-    
-    entries: list[str] = []
-    entries += [key['Key'] for key in response.get('Contents', [])]
-    entries += [folder['Prefix'] for folder in response.get('CommonPrefixes', [])]
-
-    add_season_metadata(metadata, entries, file_entries)
-
-    entries = sorted(entries, key=music_order, reverse=path == INDEX)
-
-    if path + '/' in entries:
-        entries.remove(path + '/')
-
-    if path == INDEX:
-        all_seasons_dict: dict[int, list[str]] = {}
-        other = []
-        for key in entries:
-            parent = os.path.dirname(key.rstrip('/')) + '/'
-            name, ext = os.path.splitext(key.replace(parent, '').rstrip('/'))
-            if season_match := re.search(re_season, key):
-                year = int(season_match.group(1))
-                year_seasons = all_seasons_dict.setdefault(
-                    year,
-                    ['<li class="flex-1 p-2 bg-slate-700 rounded-md"></li>']*4
-                )
 
-                season = int(season_match.group(2))
-                entry = entry_element(
-                    f'{parent}{name}{ext}', season_map[season], ext != '',
-                    liClassName="flex-1",
-                )
-                year_seasons[(season - 1) % 4] = entry
-            else:
-                entry = entry_element(f'{parent}{name}{ext}', name, ext != '')
-                other.append(entry)
-
-        season_tuples = sorted(all_seasons_dict.items(), reverse=True)
-        all_seasons_dict = dict(season_tuples)
-        for year in all_seasons_dict:
-            seasons = all_seasons_dict[year]
-            file_entries.append(f"""\
-            <li class="flex gap-2 items-center w-full">
-                <div>20{year}</div>
-                <ul class="flex-1 flex gap-2 w-full">{'\n'.join(seasons)}</ul>
-            </li>""")
-
-        file_entries += other
-    else:
-        for key in entries:
-            # e.g. key = 'folder/subfolder/subfolder/'
-            # e.g. key = 'folder/subfolder/subfolder/song.mp3'
-            parent = os.path.dirname(key.rstrip('/')) + '/'
-            # e.g. parent = 'folder/subfolder' + '/'
-            name, ext = os.path.splitext(key.replace(parent, '').rstrip('/'))
-
-            if name_match := re.match(r"(OP|ED) ?(\d+)? FULL ?(.*)", name):
-                number = f"&nbsp;{name_match.group(2)}" if name_match.group(2) else ""
-                label = ''.join([
-                    f"{badge(f"{name_match.group(1)}{number}")}",
-                    f'<span class="flex-1 text-center">{name_match.group(3)}</span>'
-                ])
-            else:
-                label = re.sub(r"(OP|ED) ?(\d+)? FULL ?", badge(r"\1&nbsp;\2"), name)
-                label = label.replace('FULL ', '')
-
-            if ext != '' and ext not in display_music_exts:
+    added_songs: list[str] = []
+    add_season_metadata(metadata, added_songs, file_entries)
+
+    is_index = path == INDEX
+    folder_key = path + '/'
+    season_keys: set[str] = set()
+    # (music_order(key), rendered entry)
+    rows: list[tuple[tuple[int, str], str]] = []
+
+    for key in itertools.chain(entries, added_songs):
+        if key == folder_key:
+            continue
+
+        # Most index keys are season folders, which are parsed only when they first appear
+        if is_index and (key in season_grid.seasons or re_season_folder.fullmatch(key)):
+            season_keys.add(key)
+            continue
+
+        entry_key = EntryKey(key)
+        is_file = entry_key.ext != ''
+
+        if is_index:
+            entry = entry_element(entry_key.path, entry_key.name, is_file)
+        else:
+            if is_file and entry_key.ext not in display_music_exts:
                 continue
+            entry = entry_element(entry_key.path, entry_key.label(), is_file, queueable=True)
+
+        rows.append((music_order(key), entry))
+
+    if is_index and (grid := season_grid.update(season_keys)):
+        file_entries.append(grid)
+
+    rows.sort(key=itemgetter(0), reverse=is_index)
+    file_entries += [entry for _, entry in rows]
 
-            entry = entry_element(f'{parent}{name}{ext}', label, ext != '')
-            file_entries.append(entry)
-    
     return f"""\
     <p id="folder-name" hx-swap-oob="true">{
        (path.rstrip('/') + '/').replace(f'{INDEX}/', '').rstrip('/')
@@ -105,62 +111,186 @@ def display_folder_contents(metadata, path: str, response) -> str:
         class="flex flex-col gap-2 p-2 w-screen md:max-w-lg"
     >{'\n'.join(file_entries)}</ul>"""
 
+def display_search_results(query: str, keys: list[str]) -> str:
+    """
+    Renders the entries found by a search in place of the folder, with each
+    song labelled with its show.
+    """
+    rows = []
+    for key in keys:
+        entry_key = EntryKey(key)
+        if key.endswith('/'):
+            rows.append(entry_element(entry_key.path, entry_key.path.replace(f'{INDEX}/', ''), False))
+            continue
+        show = os.path.basename(os.path.dirname(entry_key.path))
+        label = f'{entry_key.label()}\n<span class="text-xs">{show}</span>'
+        rows.append(entry_element(entry_key.path, label, True))
+
+    return f"""\
+    <p id="folder-name" hx-swap-oob="true">Search: {html.escape(query)}</p>
+    <ul
+        id="folder" hx-swap-oob="true" hx-boost="true"
+        class="flex flex-col gap-2 p-2 w-screen md:max-w-lg"
+    >{'\n'.join(rows) or '<li class="p-2">No results.</li>'}</ul>"""
+
+class SeasonGrid:
+    """
+    The year x season grid of the index page, kept across warm invocations.
+    Only season folders that appear or disappear from the listing are parsed,
+    and only the rows of their years are rendered again, so an unchanged index
+    costs the same however many years it covers.
+    """
+    def __init__(self):
+        # season folder key -> (year, season)
+        self.seasons: dict[str, tuple[int, int]] = {}
+        # year -> the entry of each of its 4 seasons
+        self.cells: dict[int, list[str]] = {}
+        # year -> rendered row
+        self.rows: dict[int, str] = {}
+        self.html = ''
+        self.lock = threading.Lock()
+
+    def update(self, keys: set[str]) -> str:
+        """Brings the grid up to date with the season folders of a listing and returns it."""
+        with self.lock:
+            if keys == self.seasons.keys():
+                return self.html
+
+            changed_years: set[int] = set()
+            for key in self.seasons.keys() - keys:
+                year, season = self.seasons.pop(key)
+                self.cells[year][(season - 1) % 4] = empty_season_element
+                changed_years.add(year)
+            for key in keys - self.seasons.keys():
+                season_match = re_season_folder.fullmatch(key)
+                year, season = int(season_match.group(1)), int(season_match.group(2))
+                self.seasons[key] = (year, season)
+                self.cells.setdefault(year, [empty_season_element]*4)[(season - 1) % 4] = entry_element(
+                    key.rstrip('/'), season_map[season], False, liClassName="flex-1",
+                )
+                changed_years.add(year)
+
+            for year in changed_years:
+                if all(cell is empty_season_element for cell in self.cells[year]):
+                    del self.cells[year]
+                    self.rows.pop(year, None)
+                else:
+                    self.rows[year] = season_row(year, self.cells[year])
+            self.html = '\n'.join([self.rows[year] for year in sorted(self.rows, reverse=True)])
+            return self.html
+
+def season_row(year: int, cells: list[str]) -> str:
+    return ''.join([
+        '<li class="flex gap-2 items-center w-full">\n',
+        f'<div>20{year}</div>\n',
+        '<ul class="flex-1 flex gap-2 w-full">', '\n'.join(cells), '</ul>\n',
+        '</li>',
+    ])
+
+season_grid = SeasonGrid()
+
+class EntryKey:
+    """
+    A listing key parsed once into what rendering its entry needs: the OP/ED
+    type, number and name of songs.
+    e.g. key = 'folder/24-1/' or 'folder/24-1/Show/OP 2 FULL Song.mp3'
+    """
+    __slots__ = ('path', 'name', 'ext', 'song_type', 'song_number', 'song_name')
+
+    def __init__(self, key: str):
+        path = key.rstrip('/')
+        slash = path.rfind('/')
+        if slash < 0:
+            path = '/' + path
+            slash = 0
+        # e.g. path = 'folder/24-1/Show/OP 2 FULL Song.mp3'
+        self.path = path
+        # e.g. name, ext = 'OP 2 FULL Song', '.mp3'
+        self.name, self.ext = os.path.splitext(path[slash + 1:])
+
+        self.song_type = self.song_number = self.song_name = None
+
+        if name_match := re_song.match(self.name):
+            self.song_type, self.song_number, self.song_name = name_match.groups()
+
+    def label(self) -> str:
+        if self.song_type is None:
+            label = re_song_badge.sub(song_badge, self.name)
+            return label.replace('FULL ', '')
+
+        number = f"&nbsp;{self.song_number}" if self.song_number else ""
+        return ''.join([
+            badge(f"{self.song_type}{number}"),
+            '<span class="flex-1 text-center">', self.song_name, '</span>',
+        ])
+
 def badge(text):
     return f'<span class="inline-block p-1 rounded-sm bg-slate-700 leading-none">{text}</span>'
 
-def entry_element(path, label, is_file, liClassName: str = ''):
+song_badge = badge(r"\1&nbsp;\2")
+empty_season_element = '<li class="flex-1 p-2 bg-slate-700 rounded-md"></li>'
+
+entry_li_class = 'class="flex items-center gap-2 bg-slate-700 p-2\nrounded-md'
+entry_a_class = (
+    'class="self-stretch flex-1 flex gap-2 justify-center items-center bg-slate-600 rounded-md\n'
+    'p-1 px-2 text-sm hover:bg-slate-500 focus:bg-slate-500 cursor-pointer"'
+)
+entry_button_start = (
+    '<button\n'
+    'class="flex justify-center items-center\n'
+    'bg-slate-600 rounded-md active:bg-slate-500 transition-all"\n'
+    'style="padding:0.125rem;min-width:2.5rem;min-height:2.5rem"\n'
+)
+entry_button_icon = (
+    '>\n<span\n'
+    'data-display="flex"\n'
+    'class="material-symbols-outlined flex justify-center items-center"\n'
+    'style="display:none;min-height:2rem"\n'
+)
+
+def entry_element(path, label, is_file, liClassName: str = '', queueable: bool = False):
+    """
+    Renders one row in a single f-string of precomputed constant pieces, without
+    the indentation that strip_lines would remove. Rows of queueable folders
+    get a button that adds all of their songs to the playlist.
+    """
     encoded_path = encode_path_components(path)
-    return f"""\
-    <li
-        class="flex items-center gap-2 bg-slate-700 p-2
-        rounded-md{f' {liClassName}' if liClassName else ''}"
-    >
-        <a
-            href="{URL}/{encoded_path}"
-            {f'hx-push-url="{URL}/{encoded_path}"' if not is_file else ''}
-            hx-swap="none"
-            {f'hx-on::before-request="trackClicked(\'{
-                os.path.splitext(path)[0].replace(f'{INDEX}/', '')
-            }\')"' if is_file else ''}
-            class="self-stretch flex-1 flex gap-2 justify-center items-center bg-slate-600 rounded-md
-            p-1 px-2 text-sm hover:bg-slate-500 focus:bg-slate-500 cursor-pointer"
-        >{label}</a>
-        {f"""\
-        <button
-            class="flex justify-center items-center
-            bg-slate-600 rounded-md active:bg-slate-500 transition-all"
-            style="padding:0.125rem;min-width:2.5rem;min-height:2.5rem"
-            onclick="addToPlaylist('{encoded_path}')"
-        >
-            <span
-                data-display="flex"
-                class="material-symbols-outlined flex justify-center items-center"
-                style="display:none;min-height:2rem"
-            >playlist_add</span>
-        </button>
-        <button
-            class="flex justify-center items-center
-            bg-slate-600 rounded-md active:bg-slate-500 transition-all"
-            style="padding:0.125rem;min-width:2.5rem;min-height:2.5rem"
-            onclick="viewLyrics('{encoded_path}')"
-        >
-            <span
-                data-display="flex"
-                class="material-symbols-outlined flex justify-center items-center"
-                style="display:none;min-height:2rem"
-            >lyrics</span>
-        </button>""" if is_file else ''}
-    </li>"""
+    li_class = f' {liClassName}"' if liClassName else '"'
+
+    if not is_file:
+        return (
+            f'<li\n{entry_li_class}{li_class}\n>\n'
+            f'<a\nhref="{URL}/{encoded_path}"\nhx-push-url="{URL}/{encoded_path}"\nhx-swap="none"\n'
+            f'{entry_a_class}\n>{label}</a>\n'
+            + (
+                f'{entry_button_start}onclick="queueFolder(\'{encoded_path}\')"\n'
+                f'{entry_button_icon}>playlist_add</span>\n</button>\n'
+                if queueable else ''
+            ) +
+            '</li>'
+        )
+
+    track_path = os.path.splitext(path)[0].replace(f'{INDEX}/', '')
+    return (
+        f'<li\n{entry_li_class}{li_class}\n>\n'
+        f'<a\nhref="{URL}/{encoded_path}"\nhx-swap="none"\n'
+        f'hx-on::before-request="trackClicked(\'{track_path}\')"\n'
+        f'{entry_a_class}\n>{label}</a>\n'
+        f'{entry_button_start}onclick="addToPlaylist(\'{encoded_path}\')"\n'
+        f'{entry_button_icon}>playlist_add</span>\n</button>\n'
+        f'{entry_button_start}onclick="viewLyrics(\'{encoded_path}\')"\n'
+        f'{entry_button_icon}>lyrics</span>\n</button>\n'
+        '</li>'
+    )
 
 def find_season(period: int, d: int) -> str | None:
-    while period_min < period < period_max:
-        period += d
-        year = period // 4
-        season = (period % 4) + 1
-        season = f'{year}-{season}'
-        if get_s3_folder(f'{INDEX}/{season}'):
-            return season
-    return None
+    if not period_min < period < period_max:
+        return None
+
+    found = season_index.previous(period) if d < 0 else season_index.next(period)
+    if found is None or not period_min <= found <= period_max:
+        return None
+    return format_period(found)
 
 def music_order(name):
     if '/OP ' in name:
@@ -174,8 +304,8 @@ def add_season_navigation(path: str, file_entries: list[str], season, show):
     previous_season = None
     next_season = None
 
-    if season and not show and (season_match := re.search(re_season, season)):
-        period = int(season_match.group(1)) * 4 + (int(season_match.group(2)) - 1) % 4
+    if season and not show and (season_match := re_season_compiled.search(season)):
+        period = to_period(int(season_match.group(1)), int(season_match.group(2)))
         previous_season = find_season(period, -1)
         next_season = find_season(period, +1)
 
@@ -208,82 +338,41 @@ def add_season_navigation(path: str, file_entries: list[str], season, show):
         </ul></li>""",
     )
 
+# kind of link -> label, and the icon and its transform of the previous and next link
+link_styles = {
+    'Season': ('Season', 'skip_previous', 'translate(-1px, 1px)', 'skip_next', 'translate(9px, 1px)'),
+    'Cour': ('Cour', 'arrow_back_2', 'translateY(1px)', 'play_arrow', 'translate(8px, 1px)'),
+    'SplitCour': ('Split Cour', 'fast_rewind', 'translate(1px, 1px)', 'fast_forward', 'translate(9px, 1px)'),
+}
+
 def add_season_metadata(metadata, entries, file_entries):
+    """Adds the folder's previous/next links, and the songs that its metadata.json adds."""
     if metadata == None:
         return
 
-    folder_data: dict[str, Any] = metadata.get("folderMetadata", {})
-    if "previousSeason" in folder_data or "nextSeason" in folder_data:
-        file_entries.append(f"""\
-        <li><ul class="flex gap-2">
-            {entry_element(
-            f'{INDEX}/{folder_data['previousSeason']}/', f"""\
-            <strong class="{arrow_classes}" style="transform:translate(-1px, 1px)">skip_previous</strong>
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Previous Season</span>
-                <span class="text-sm">{folder_data['previousSeason']}</span>
-            </div>""",
-            False, liClassName="flex-1")\
-            if "previousSeason" in folder_data else '<li class="flex-1 p-2"></li>'}
-
-            {entry_element(
-            f'{INDEX}/{folder_data['nextSeason']}/', f"""\
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Next Season</span>
-                <span class="text-sm">{folder_data['nextSeason']}</span>
-            </div>
-            <strong class="{arrow_classes}" style="transform:translate(9px, 1px)">skip_next</strong>""",
-            False, liClassName="flex-1")\
-            if "nextSeason" in folder_data else '<li class="flex-1 p-2"></li>'}
-        </ul></li>""")
-
-    if "previousCour" in folder_data or "nextCour" in folder_data:
-        file_entries.append(f"""\
-        <li><ul class="flex gap-2">
-            {entry_element(
-            f'{INDEX}/{folder_data['previousCour']}/', f"""\
-            <strong class="{arrow_classes}" style="transform:translateY(1px)">arrow_back_2</strong>
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Previous Cour</span>
-                <span class="text-sm">{folder_data['previousCour']}</span>
-            </div>""",
-            False, liClassName="flex-1")\
-            if "previousCour" in folder_data else '<li class="flex-1 p-2"></li>'}
-
-            {entry_element(
-            f'{INDEX}/{folder_data['nextCour']}/', f"""\
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Next Cour</span>
-                <span class="text-sm">{folder_data['nextCour']}</span>
-            </div>
-            <strong class="{arrow_classes}" style="transform:translate(8px, 1px)">play_arrow</strong>""",
-            False, liClassName="flex-1")\
-            if "nextCour" in folder_data else '<li class="flex-1 p-2"></li>'}
-        </ul></li>""")
-
-    if "previousSplitCour" in folder_data or "nextSplitCour" in folder_data:
-        file_entries.append(f"""\
-        <li><ul class="flex gap-2">
-            {entry_element(
-            f'{INDEX}/{folder_data['previousSplitCour']}/', f"""\
-            <strong class="{arrow_classes}" style="transform:translate(1px, 1px)">fast_rewind</strong>
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Previous Split Cour</span>
-                <span class="text-sm">{folder_data['previousSplitCour']}</span>
-            </div>""",
-            False, liClassName="flex-1")\
-            if "previousSplitCour" in folder_data else '<li class="flex-1 p-2"></li>'}
-
-            {entry_element(
-            f'{INDEX}/{folder_data['nextSplitCour']}/', f"""\
-            <div class="flex-1 flex flex-col text-left">
-                <span class="text-xs">Next Split Cour</span>
-                <span class="text-sm">{folder_data['nextSplitCour']}</span>
-            </div>
-            <strong class="{arrow_classes}" style="transform:translate(9px, 1px)">fast_forward</strong>""",
-            False, liClassName="flex-1")\
-            if "nextSplitCour" in folder_data else '<li class="flex-1 p-2"></li>'}
-        </ul></li>""")
-
-    for song_path in metadata.get("addSongs", []):
+    for kind, previous, next in metadata.links:
+        label, previous_icon, previous_transform, next_icon, next_transform = link_styles[kind]
+        previous_entry = entry_element(
+            f'{INDEX}/{previous}/', (
+                f'<strong class="{arrow_classes}" style="transform:{previous_transform}">{previous_icon}</strong>\n'
+                '<div class="flex-1 flex flex-col text-left">\n'
+                f'<span class="text-xs">Previous {label}</span>\n'
+                f'<span class="text-sm">{previous}</span>\n'
+                '</div>'
+            ),
+            False, liClassName="flex-1",
+        ) if previous is not None else '<li class="flex-1 p-2"></li>'
+        next_entry = entry_element(
+            f'{INDEX}/{next}/', (
+                '<div class="flex-1 flex flex-col text-left">\n'
+                f'<span class="text-xs">Next {label}</span>\n'
+                f'<span class="text-sm">{next}</span>\n'
+                '</div>\n'
+                f'<strong class="{arrow_classes}" style="transform:{next_transform}">{next_icon}</strong>'
+            ),
+            False, liClassName="flex-1",
+        ) if next is not None else '<li class="flex-1 p-2"></li>'
+        file_entries.append(f'<li><ul class="flex gap-2">\n{previous_entry}\n\n{next_entry}\n</ul></li>')
+
+    for song_path in metadata.add_songs:
         entries.append(f'{INDEX}/{song_path}')
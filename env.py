@@ -1,9 +1,77 @@
-import os
-import boto3
-
-s3_client = boto3.client('s3')
+import os, threading
 
 BUCKET = os.getenv('PLAYER_BUCKET', '') # e.g. player-files
 URL = os.getenv('PLAYER_URL', '').rstrip('/') # e.g. https://example-website.com/player
 INDEX = os.getenv('PLAYER_INDEX', '').lstrip('/').rstrip('/') # e.g. index
 IMAGES = os.getenv('PLAYER_IMAGES', '').rstrip('/') # e.g. https://example-website.com/images
+LOCAL_ROOT = os.getenv('PLAYER_LOCAL_ROOT', '') # e.g. /srv/player-files, a mirror of the bucket served instead of S3
+
+# Seconds that the list of populated seasons is reused across warm invocations
+SEASON_TTL = int(os.getenv('PLAYER_SEASON_TTL', '300'))
+# Seconds between checks of the library for the search index, when there is no catalog to watch
+SEARCH_TTL = int(os.getenv('PLAYER_SEARCH_TTL', '300'))
+
+# Concurrent S3 calls per invocation
+S3_WORKERS = int(os.getenv('PLAYER_S3_WORKERS', '8'))
+
+# S3 client connection pool, covering every worker plus the request thread, and its failure handling
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('PLAYER_S3_MAX_POOL_CONNECTIONS', str(S3_WORKERS + 2)))
+S3_CONNECT_TIMEOUT = float(os.getenv('PLAYER_S3_CONNECT_TIMEOUT', '2'))
+S3_READ_TIMEOUT = float(os.getenv('PLAYER_S3_READ_TIMEOUT', '5'))
+S3_MAX_ATTEMPTS = int(os.getenv('PLAYER_S3_MAX_ATTEMPTS', '3'))
+
+# Seconds that a request waits for another request's identical S3 call before giving up
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('PLAYER_SINGLE_FLIGHT_TIMEOUT', '10'))
+
+# Seconds that a resolved path type is cached, and the shorter lifetime of "not found"
+RESOLVE_TTL = int(os.getenv('PLAYER_RESOLVE_TTL', '300'))
+MISSING_TTL = int(os.getenv('PLAYER_MISSING_TTL', '30'))
+RESOLVE_CACHE_SIZE = int(os.getenv('PLAYER_RESOLVE_CACHE_SIZE', '4096'))
+
+# Key of the catalog manifest written by `python catalog.py`, and how often its ETag is checked
+CATALOG = os.getenv('PLAYER_CATALOG', 'catalog.json.gz')
+CATALOG_CHECK_INTERVAL = int(os.getenv('PLAYER_CATALOG_CHECK_INTERVAL', '60'))
+
+# Total characters of rendered folder fragments kept per container
+FRAGMENT_CACHE_SIZE = int(os.getenv('PLAYER_FRAGMENT_CACHE_SIZE', str(8 * 1024 * 1024)))
+
+# Total bytes of metadata.json files kept parsed per container, and revalidated by ETag
+METADATA_CACHE_SIZE = int(os.getenv('PLAYER_METADATA_CACHE_SIZE', str(4 * 1024 * 1024)))
+
+# Total characters of rendered lyrics kept per container
+LYRICS_CACHE_SIZE = int(os.getenv('PLAYER_LYRICS_CACHE_SIZE', str(2 * 1024 * 1024)))
+
+# Song URLs are presigned once per window of this many seconds, and stay valid for two windows
+PRESIGN_WINDOW = int(os.getenv('PLAYER_PRESIGN_WINDOW', str(60*30)))
+# Total characters of presigned URLs kept per container
+PRESIGN_CACHE_SIZE = int(os.getenv('PLAYER_PRESIGN_CACHE_SIZE', str(1024 * 1024)))
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv('PLAYER_COMPRESS_MIN_SIZE', '1024'))
+
+# Fraction of requests, from 0 to 1, that log a JSON line of timings and counters.
+# Off by default; e.g. PLAYER_METRICS_SAMPLE=0.05 logs one request in 20.
+METRICS_SAMPLE_RATE = float(os.getenv('PLAYER_METRICS_SAMPLE', '0'))
+
+s3_client = None
+s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """
+    Returns the container's S3 client, importing boto3 and creating the client
+    on first use so that responses which never touch S3 skip that cost.
+    """
+    global s3_client
+    if s3_client is None:
+        with s3_client_lock:
+            if s3_client is None:
+                import boto3
+                from botocore.config import Config
+                s3_client = boto3.client('s3', config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    connect_timeout=S3_CONNECT_TIMEOUT,
+                    read_timeout=S3_READ_TIMEOUT,
+                    retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'},
+                ))
+    return s3_client
@@ -36,22 +36,19 @@ async function loadMusic() {
 		}
 	}
 
+	let lyricsElement = document.getElementById('lyrics')
+	let timingElement = document.getElementById('lyrics-timing')
+	lyricsElement && (lyricsElement.innerHTML = '')
+	timingElement && (timingElement.innerHTML = '')
+
 	// @ts-ignore
 	if ('{{ hasLyrics }}' === 'true') {
 		let lyricsContainerElement;
 		if (lyricsContainerElement = document.getElementById('lyrics-container')) {
 			lyricsContainerElement.style.display = ''
 		}
-	}
-
-	let lyricsElement;
-	if (lyricsElement = document.getElementById('lyrics')) {
-		lyricsElement.innerHTML = '{{ lyrics }}'
-	}
 
-	let timingElement;
-	if (timingElement = document.getElementById('lyrics-timing')) {
-		timingElement.innerHTML = '{{ lyricsTiming }}'
+		await loadLyrics('{{ lyricsUrl }}', path)
 	}
 }
 loadMusic()
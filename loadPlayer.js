@@ -132,7 +132,11 @@ function initAudio() {
 		app.animationFrameId !== null && cancelAnimationFrame(app.animationFrameId)
 		app.animationFrameId = null
 
-		if (!audio.loop) await resetPlayer()
+		if (audio.loop) return
+		// Play the next song of the playlist, when it has one
+		// @ts-ignore
+		if (typeof playNext === 'function' && await playNext()) return
+		await resetPlayer()
 	}
 
 	audio.onerror = async () => {
@@ -312,6 +316,26 @@ async function loadPlayer() {
 	elements.audio && (elements.audio.src = app.signedUrl)
 }
 
+/** @param {string} url
+  * @param {string} path */
+async function loadLyrics(url, path) {
+	const response = await fetch(url)
+	// Another song may have started loading meanwhile
+	if (!response.ok || app.currentPath !== path) return
+	const lyrics = await response.json()
+
+	const lyricsElement = document.getElementById('lyrics')
+	const timingElement = document.getElementById('lyrics-timing')
+	lyricsElement && (lyricsElement.innerHTML = lyrics.html)
+	timingElement && (timingElement.innerHTML = JSON.stringify(lyrics.timing))
+
+	// The player reads the lyrics once the audio can play, which may already have happened
+	if (app.loaded && lyricsElement) {
+		app.lyrics = new Lyrics(lyricsElement.innerText)
+		app.lyrics.timing = lyrics.timing
+	}
+}
+
 function togglePlay() {
 	if (app.playing) { pause() }
 	else { play() }
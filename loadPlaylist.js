@@ -56,13 +56,84 @@ tabs.forEach((tab, i) => {
 
 setActiveTab(0)
 
+var batchUrl = '{{ url }}/batch'
+
+/** @typedef {{ key: string, path: string, href: string, url: string, name: string, lyricsUrl: string | null }} Song */
+/** @typedef {{ url: string, song?: Song, expires?: number }} PlaylistItem */
+
+/** @param {string} query - A folder as `/path`, or `?path=...&path=...`
+  * @returns {Promise<{ songs: Song[], expires: number }>} */
+async function fetchSongs(query) {
+	const response = await fetch(batchUrl + query)
+	if (!response.ok) return { songs: [], expires: 0 }
+	return await response.json()
+}
+
 /** @param {string} url */
-function addToPlaylist(url) {
+async function addToPlaylist(url) {
 	const playlistPanel = document.getElementById('panel-playlist')
 	if (!playlistPanel) return
 
 	playlistPanel.insertAdjacentHTML('beforeend', entry(url, url))
-	app.playlist.push({url})
+	/** @type {PlaylistItem} */
+	const item = {url}
+	app.playlist.push(item)
+
+	// Fetched now, so that the song can play next without loading its page
+	const { songs: [song], expires } = await fetchSongs(`?path=${url}`)
+	if (song) Object.assign(item, { song, expires })
+}
+
+/** Queues every song of a folder after a single request
+  * @param {string} folder - The encoded folder path */
+async function queueFolder(folder) {
+	const playlistPanel = document.getElementById('panel-playlist')
+	if (!playlistPanel) return
+
+	const { songs, expires } = await fetchSongs(`/${folder}`)
+	for (const song of songs) {
+		playlistPanel.insertAdjacentHTML('beforeend', entry(song.href, song.name))
+		app.playlist.push({ url: song.href, song, expires })
+	}
+	/* @ts-ignore */
+	htmx.process(playlistPanel)
+}
+
+/** Plays the playlist song after the current one without loading its page
+  * @returns {Promise<boolean>} Whether a song was started */
+async function playNext() {
+	/** @type {PlaylistItem[]} */
+	const playlist = app.playlist
+	const index = playlist.findIndex(item => item.song?.path === app.currentPath)
+	const next = playlist[index + 1]
+	if (index < 0 || !next?.song) return false
+
+	// Presigned URLs expire, so refresh them a minute early
+	if (!next.expires || next.expires - 60 < Date.now() / 1000) {
+		const { songs: [song], expires } = await fetchSongs(`?path=${encodeURIComponent(next.song.key)}`)
+		if (!song) return false
+		Object.assign(next, { song, expires })
+	}
+	const song = /** @type {Song} */ (next.song)
+
+	history.pushState({}, '', song.href)
+	document.title = `${song.name} | Seasons Music`
+	app.currentPath = song.path
+	app.signedUrl = song.url
+	app.lyrics = undefined
+
+	const nameElement = document.getElementById('name')
+	nameElement && (nameElement.innerText = song.name)
+	const lyricsElement = document.getElementById('lyrics')
+	const timingElement = document.getElementById('lyrics-timing')
+	lyricsElement && (lyricsElement.innerHTML = '')
+	timingElement && (timingElement.innerHTML = '')
+	const lyricsContainerElement = document.getElementById('lyrics-container')
+	lyricsContainerElement && (lyricsContainerElement.style.display = song.lyricsUrl ? '' : 'none')
+
+	await loadPlayer()
+	if (song.lyricsUrl) await loadLyrics(song.lyricsUrl, song.path)
+	return true
 }
 
 /** @typedef {{ url: string, name: string }} Recent */
@@ -0,0 +1,93 @@
+"""
+Per-request timings and counters, emitted as one compact JSON line per
+sampled request. Outside a sampled request every call here is a no-op.
+Sampling is opt-in: set PLAYER_METRICS_SAMPLE to the fraction of requests
+to log, e.g. 0.05, or 1 to log them all.
+"""
+import contextvars, json, random, threading, time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Iterator
+
+from env import METRICS_SAMPLE_RATE
+
+class RequestMetrics:
+    __slots__ = ('start', 'durations', 'counts', 'values', 'lock')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # span name -> total seconds
+        self.durations: dict[str, float] = {}
+        # span or counter name -> occurrences
+        self.counts: dict[str, int] = {}
+        self.values: dict[str, Any] = {}
+        # Spans are also recorded from the S3 worker threads
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def line(self) -> str:
+        return json.dumps({
+            'metric': 'request',
+            **self.values,
+            'duration_ms': round((time.perf_counter() - self.start) * 1000, 2),
+            'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in self.durations.items()},
+            'counts': self.counts,
+        }, separators=(',', ':'))
+
+current_metrics: contextvars.ContextVar[RequestMetrics | None] = contextvars.ContextVar(
+    'current_metrics', default=None
+)
+cold_start = True
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    if (metrics := current_metrics.get()) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - start)
+
+def count(name: str, n: int = 1):
+    if (metrics := current_metrics.get()) is not None:
+        metrics.count(name, n)
+
+def record(name: str, value: Any):
+    if (metrics := current_metrics.get()) is not None:
+        metrics.values[name] = value
+
+def instrument(handler: Callable[[Any, Any], dict[str, Any]]):
+    """
+    Wraps a Lambda handler so that a METRICS_SAMPLE_RATE fraction of requests
+    print a metrics line with their spans, counters, status and cold start.
+    """
+    @wraps(handler)
+    def instrumented(event, context):
+        global cold_start
+        is_cold_start, cold_start = cold_start, False
+
+        if METRICS_SAMPLE_RATE <= 0 or random.random() >= METRICS_SAMPLE_RATE:
+            return handler(event, context)
+
+        metrics = RequestMetrics()
+        metrics.values['cold_start'] = is_cold_start
+        token = current_metrics.set(metrics)
+        try:
+            response = handler(event, context)
+            metrics.values['status'] = response.get('statusCode')
+            return response
+        finally:
+            current_metrics.reset(token)
+            print(metrics.line())
+
+    return instrumented
@@ -0,0 +1,477 @@
+import os, mimetypes
+import base64
+import re, json, time
+from functools import partial
+from http import cookies
+from typing import Callable, Iterable
+
+from env import URL, INDEX, IMAGES, LYRICS_CACHE_SIZE, PRESIGN_WINDOW
+from utils import (
+    season_map, re_season, ItemType, TransientS3Error,
+    run_concurrently, fingerprint, presign_window, encode_path_components, get_song_name,
+)
+from storage import storage, LocalStorage, stat_etag
+from streaming import stream_file
+from cache import LRUCache
+from catalog import resolve, get_folder, get_metadata, file_exists
+from seasons import season_index
+from entries import display_folder_contents, display_search_results, display_music_exts, music_order
+from search import search_index
+import templates
+from templates import strip_lines
+from compression import Part, encode_parts, negotiate, stream_parts
+import metrics
+
+# The content varies by fragment vs. full page and by the Signed-In cookie,
+# and its encoding by the Accept-Encoding that it was negotiated with
+VARY = 'Hx-Request, Hx-History-Restore-Request, Cookie, Accept-Encoding'
+# Vary of the compressed routes that only vary by the Signed-In cookie
+COOKIE_VARY = 'Cookie, Accept-Encoding'
+# Seconds that a browser can reuse a folder fragment without revalidating
+FRAGMENT_MAX_AGE = 60
+# Seconds that a browser can reuse a song's lyrics without revalidating
+LYRICS_MAX_AGE = 60*5
+# Songs that a single batch request can name
+BATCH_MAX_PATHS = 50
+# Entries that a search returns
+SEARCH_MAX_RESULTS = 50
+
+# (folder path, song name) -> lyrics response body, versioned by the folder's metadata.json ETag
+lyrics_cache = LRUCache(LYRICS_CACHE_SIZE)
+
+def render_page(event, path: str):
+    """Renders a folder or song page, or its htmx fragment."""
+    request_headers = get_request_headers(event)
+
+    HX_REQUEST = request_headers.get('hx-request') == 'true' and request_headers.get('hx-history-restore-request') != 'true'
+
+    signed_in = is_signed_in(request_headers)
+
+    if HX_REQUEST and not signed_in:
+        return forbidden_response(VARY)
+
+    parent = os.path.dirname(path)
+
+    # Guess the item type from the extension, so that the listing and metadata of the folder to
+    # display are fetched at the same time as the path is resolved, which lists S3 on a cache miss
+    looks_like_file = os.path.splitext(path)[1] in display_music_exts
+    folder_path = parent if looks_like_file else path
+    try:
+        item_type, response, metadata = run_concurrently(
+            partial(resolve, path),
+            partial(get_folder, folder_path),
+            partial(get_metadata, folder_path),
+        )
+        if item_type == ItemType.MISSING:
+            return {"statusCode": 404, "body": "Failed to find file."}
+
+        if (item_type == ItemType.FILE) != looks_like_file:
+            folder_path = parent if item_type == ItemType.FILE else path
+            response, metadata = run_concurrently(
+                partial(get_folder, folder_path),
+                partial(get_metadata, folder_path),
+            )
+    except TransientS3Error:
+        return storage_error_response()
+
+    if item_type == ItemType.FOLDER and not response:
+        return {"statusCode": 404, "body": "Failed to find file."}
+
+    response_headers = {}
+    response_headers['Vary'] = VARY
+    response_headers['ETag'] = get_etag(
+        path,
+        item_type.name,
+        response.fingerprint if response else '',
+        metadata.etag if metadata else '',
+        season_index.get_fingerprint(),
+        'signed-in' if signed_in else '',
+        'hx' if HX_REQUEST else '',
+        # Pages with a song embed its presigned URL, which changes with each window
+        str(presign_window()) if item_type == ItemType.FILE else '',
+    )
+    if HX_REQUEST and item_type == ItemType.FOLDER:
+        response_headers['Cache-Control'] = f'private, max-age={FRAGMENT_MAX_AGE}'
+    else:
+        response_headers['Cache-Control'] = 'private, no-cache'
+
+    if etag_matches(request_headers.get('if-none-match'), response_headers['ETag']):
+        return {"statusCode": 304, "headers": response_headers, "body": ""}
+
+    # Rendered when the page reaches them, so that a streamed page can send its head first.
+    # They only read the listing and metadata fetched above, so they cannot fail on storage.
+    folder_content: Callable[[], str] | None = None
+    parent_folder_content: Callable[[], str] | None = None
+    error = ""
+
+    title = "Seasons Music"
+    description = "A personal music player."
+    logo = f"{IMAGES}/logo-small-a.png"
+    url = f'{URL}/{path}'
+
+    basename = os.path.basename(path)
+    match = re.match(re_season, path)
+    if match:
+        year = "20" + match.group(1)
+        season = season_map.get(int(match.group(2)), "")
+        title = f"{year} {season} | Seasons Music"
+        description = f"Some anime music from the {year} {season} season"
+
+    match item_type:
+        case ItemType.FOLDER:
+            if basename != INDEX:
+                title = f"{basename} | Seasons Music"
+
+            # print(path)
+            # print(response)
+
+            hx_fragment = f"""\
+            <title id="title" hx-swap-oob="true">{title}</title>
+            """
+            folder_content = partial(display_folder_contents, metadata, path, response)
+
+            audio = [
+                *get_file_template(""),
+                '<script id="load-music" type="text/javascript"></script>',
+            ]
+        case ItemType.FILE:
+            url = storage.url_for(path)
+
+            if response:
+                parent_folder_content = partial(display_folder_contents, metadata, parent, response)
+            else:
+                error = "Failed to list parent folder."
+
+            path_name = os.path.splitext(path)[0]
+            name = get_song_name(path)
+
+            title = f"{name} | Seasons Music"
+
+            # The lyrics themselves are fetched from the lyrics route when the song loads
+            has_lyrics = get_song_lyrics(metadata, name) is not None
+
+            with metrics.span('render'):
+                load_music = templates.render(
+                    'loadMusic.js',
+                    url=url.replace("'", "\\'"),
+                    path=path_name.replace("'", "\\'").replace(f'{INDEX}/', ''),
+                    name=name,
+                    loadPlayer='loadPlayer()' if HX_REQUEST else '',
+                    hasLyrics="true" if has_lyrics else "false",
+                    lyricsUrl=f'{URL}/lyrics/{encode_path_components(path)}'.replace("'", "\\'"),
+                )
+
+            hx_fragment = f"""\
+            <title id="title" hx-swap-oob="true">{title}</title>
+            <script id="load-music" hx-swap-oob="true" type="text/javascript">
+                {load_music}
+            </script>"""
+
+            audio = get_file_template(
+                f"""\
+                <button
+                    id="load-button" onclick="loadPlayer()"
+                    class="bg-red-600 p-2 rounded-md"
+                >Click to start loading</button>"""
+            )
+
+    hx_fragment = strip_lines(hx_fragment)
+    hx_fragment_end = ''
+    if signed_in:
+        hx_fragment_end = f"""\
+        <script id="reveal-icons" hx-swap-oob="true" type="text/javascript">
+        // document.fonts.ready did not work
+        document.fonts.onloadingdone = revealIcons 
+        </script>"""
+        # Client-side loading metadata. Needed?
+        # hx_fragment += f"""<script
+        #    src="{URL}/metadata/{path.replace(f'{INDEX}/', '')}" type="text/javascript"
+        # ></script>"""
+    hx_fragment_end = strip_lines(hx_fragment_end)
+
+    response_headers['Content-Type'] = 'text/html'
+    if HX_REQUEST:
+        parts: list[Part] = [''.join([
+            hx_fragment,
+            strip_lines(folder_content()) if folder_content else '',
+            hx_fragment_end,
+        ])]
+    else:
+        if signed_in:
+            content = [
+                *audio,
+                templates.search,
+                hx_fragment,
+                stripped(folder_content) if folder_content else '',
+                hx_fragment_end,
+                stripped(parent_folder_content) if parent_folder_content else '',
+                templates.playlist,
+                templates.load_playlist,
+                get_error_content(error),
+            ]
+        else:
+            content = templates.password
+
+        page_parts = templates.iter_parts(
+            'index.html',
+            title=title,
+            logo=logo,
+            description=description,
+            url=url,
+            css=templates.css if signed_in else '',
+            content=content,
+        )
+        if (event.get('requestContext') or {}).get('streaming'):
+            return stream_response(page_parts, request_headers, response_headers)
+        with metrics.span('render'):
+            parts = list(page_parts)
+
+    return encode_response(parts, request_headers, response_headers)
+
+def render_lyrics(event, path: str):
+    """
+    Returns the lyrics of the song at a path as JSON, with the text already
+    rendered to HTML and its timing data.
+    """
+    request_headers = get_request_headers(event)
+    if not is_signed_in(request_headers):
+        return forbidden_response()
+
+    folder_path = os.path.dirname(path)
+    name = get_song_name(path)
+    try:
+        metadata = get_metadata(folder_path)
+    except TransientS3Error:
+        return storage_error_response()
+
+    if (lyrics := get_song_lyrics(metadata, name)) is None:
+        return {"statusCode": 404, "body": "Failed to find lyrics."}
+
+    response_headers = {
+        'Vary': COOKIE_VARY,
+        'ETag': get_etag('lyrics', path, metadata.etag),
+        'Cache-Control': f'private, max-age={LYRICS_MAX_AGE}',
+    }
+    if etag_matches(request_headers.get('if-none-match'), response_headers['ETag']):
+        return {"statusCode": 304, "headers": response_headers, "body": ""}
+
+    if (body := lyrics_cache.get((folder_path, name), metadata.etag)) is None:
+        body = json.dumps({
+            'html': "".join([
+                f"<p>{"<br>".join(l.split("\n"))}</p>"
+                for l in lyrics.get("text", "").split("\n\n")
+            ]),
+            'timing': lyrics.get("timing", []),
+        }, separators=(',', ':'), ensure_ascii=False)
+        lyrics_cache.set((folder_path, name), body, metadata.etag)
+
+    response_headers['Content-Type'] = 'application/json'
+    return encode_response([body], request_headers, response_headers)
+
+def render_batch(event, path: str):
+    """
+    Returns the presigned URL, name and lyrics availability of every song in a
+    folder (batch/<folder>), or of up to BATCH_MAX_PATHS songs given as `path`
+    query parameters (batch?path=...&path=...), so that they can be queued
+    after a single request.
+    """
+    request_headers = get_request_headers(event)
+    if not is_signed_in(request_headers):
+        return forbidden_response()
+
+    try:
+        if path:
+            if (listing := get_folder(path)) is None:
+                return {"statusCode": 404, "body": "Failed to find folder."}
+            song_paths = sorted([
+                key for key in listing
+                if os.path.splitext(key)[1] in display_music_exts
+            ], key=music_order)
+        else:
+            song_paths = [
+                song_path.lstrip('/').rstrip('/')
+                for song_path in dict.fromkeys(get_query_values(event, 'path'))
+            ]
+            if not song_paths or len(song_paths) > BATCH_MAX_PATHS:
+                return {"statusCode": 400, "body": f"Expected 1 to {BATCH_MAX_PATHS} path parameters."}
+            exists = run_concurrently(*[partial(file_exists, song_path) for song_path in song_paths])
+            song_paths = [
+                song_path for song_path, song_exists in zip(song_paths, exists)
+                if song_exists and os.path.splitext(song_path)[1] in display_music_exts
+            ]
+
+        folders = list(dict.fromkeys([os.path.dirname(song_path) for song_path in song_paths]))
+        folder_metadata = dict(zip(folders, run_concurrently(*[
+            partial(get_metadata, folder) for folder in folders
+        ])))
+    except TransientS3Error:
+        return storage_error_response()
+
+    window = presign_window()
+    songs = []
+    for song_path, url in zip(song_paths, storage.urls_for(song_paths, window)):
+        name = get_song_name(song_path)
+        has_lyrics = get_song_lyrics(folder_metadata[os.path.dirname(song_path)], name) is not None
+        encoded_path = encode_path_components(song_path)
+        songs.append({
+            'key': song_path,
+            'path': os.path.splitext(song_path)[0].replace(f'{INDEX}/', ''),
+            'href': f'{URL}/{encoded_path}',
+            'url': url,
+            'name': name,
+            'lyricsUrl': f'{URL}/lyrics/{encoded_path}' if has_lyrics else None,
+        })
+
+    response_headers = {
+        'Vary': COOKIE_VARY,
+        # The presigned URLs are reissued with the next window
+        'Cache-Control': f'private, max-age={PRESIGN_WINDOW - int(time.time()) % PRESIGN_WINDOW}',
+        'Content-Type': 'application/json',
+    }
+    body = json.dumps({
+        'songs': songs,
+        # When the presigned URLs stop working, in seconds since the epoch
+        'expires': (window + 2) * PRESIGN_WINDOW,
+    }, separators=(',', ':'), ensure_ascii=False)
+    return encode_response([body], request_headers, response_headers)
+
+def render_search(event):
+    """
+    Returns the entries matching the `q` query parameter as a fragment that
+    replaces the folder.
+    """
+    request_headers = get_request_headers(event)
+    if not is_signed_in(request_headers):
+        return forbidden_response()
+
+    query = ' '.join(get_query_values(event, 'q')).strip()
+    if not query:
+        # Leaves the folder as it is
+        return {"statusCode": 204, "headers": {"Cache-Control": "no-store"}, "body": ""}
+
+    try:
+        with metrics.span('search'):
+            keys = search_index.search(query, SEARCH_MAX_RESULTS)
+    except TransientS3Error:
+        return storage_error_response()
+
+    response_headers = {
+        'Vary': COOKIE_VARY,
+        'Cache-Control': f'private, max-age={FRAGMENT_MAX_AGE}',
+        'Content-Type': 'text/html',
+    }
+    return encode_response([strip_lines(display_search_results(query, keys))], request_headers, response_headers)
+
+def render_file(event, path: str):
+    """
+    Returns an object of a local library, at the URLs that LocalStorage hands
+    out, or the byte ranges of it that the request asks for. When the event
+    comes from server.py, the body is left as a StreamedFile for it to send.
+    """
+    request_headers = get_request_headers(event)
+    if not is_signed_in(request_headers):
+        return forbidden_response()
+
+    if not isinstance(storage, LocalStorage) or (local_path := storage.local_path(path)) is None:
+        return {"statusCode": 404, "body": "Failed to find file."}
+    try:
+        stat = os.stat(local_path)
+    except OSError:
+        return {"statusCode": 404, "body": "Failed to find file."}
+    if not os.path.isfile(local_path):
+        return {"statusCode": 404, "body": "Failed to find file."}
+
+    response_headers = {
+        'Vary': 'Cookie',
+        'ETag': stat_etag(stat),
+        # Like the presigned URLs, so that replays are served from the browser's cache
+        'Cache-Control': f'private, max-age={PRESIGN_WINDOW}',
+    }
+    if etag_matches(request_headers.get('if-none-match'), response_headers['ETag']):
+        return {"statusCode": 304, "headers": response_headers, "body": ""}
+
+    content_type = mimetypes.guess_type(local_path)[0] or 'application/octet-stream'
+    status, body = stream_file(
+        local_path, stat, response_headers['ETag'], content_type, request_headers, response_headers,
+    )
+    if (event.get('requestContext') or {}).get('sendfile'):
+        return {"statusCode": status, "headers": response_headers, "stream": body}
+    return {
+        "statusCode": status,
+        "headers": response_headers,
+        "isBase64Encoded": True,
+        "body": base64.b64encode(body.read()).decode('utf-8'),
+    }
+
+def stream_response(parts: Iterable[Part], request_headers: dict[str, str], response_headers: dict[str, str]):
+    """
+    Returns a response whose body is a generator of compressed chunks, which
+    renders the page as server.py sends it with chunked transfer encoding, so
+    that the head of the page goes out while the folder listings still render.
+    """
+    encoding = negotiate(request_headers.get('accept-encoding', ''))
+    if encoding:
+        response_headers['Content-Encoding'] = encoding
+        metrics.record('encoding', encoding)
+    return {"statusCode": 200, "headers": response_headers, "chunks": stream_parts(parts, encoding)}
+
+def stripped(render: Callable[[], str]) -> Callable[[], str]:
+    return lambda: strip_lines(render())
+
+def get_request_headers(event) -> dict[str, str]:
+    request_headers = event.get('headers') or {}
+    return {k.lower(): v for k, v in request_headers.items()}
+
+def get_query_values(event, name: str) -> list[str]:
+    if values := (event.get('multiValueQueryStringParameters') or {}).get(name):
+        return values
+    value = (event.get('queryStringParameters') or {}).get(name)
+    return [value] if value else []
+
+def is_signed_in(request_headers: dict[str, str]) -> bool:
+    C = cookies.SimpleCookie()
+    C.load(request_headers.get('cookie') or '')
+    signed_in = C.get('Signed-In')
+    return bool(signed_in and signed_in.value)
+
+def get_song_lyrics(metadata, name: str) -> dict | None:
+    return metadata.lyrics.get(name) if metadata else None
+
+def encode_response(parts: list[Part], request_headers: dict[str, str], response_headers: dict[str, str]):
+    body, encoding = encode_parts(parts, request_headers.get('accept-encoding', ''))
+    if encoding:
+        response_headers['Content-Encoding'] = encoding
+        with metrics.span('base64'):
+            body = base64.b64encode(body).decode('utf-8')
+
+    return {
+        "statusCode": 200,
+        "headers": response_headers,
+        "isBase64Encoded": encoding is not None,
+        "body": body,
+    }
+
+def get_etag(*parts: str) -> str:
+    # Weak, since the same content is sent with different encodings
+    return f'W/"{fingerprint(templates.version, *parts)}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque_tag = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque_tag for tag in if_none_match.split(','))
+
+def get_file_template(content) -> list[Part]:
+    return templates.parts('audio', content=strip_lines(content))
+
+def get_error_content(content):
+    return f'<p id="error" class="text-red-600">{content}</p>'
+
+def forbidden_response(vary: str = 'Cookie'):
+    # Not cached, so that signing in takes effect at once
+    return {"statusCode": 403, "headers": {"Cache-Control": "no-store", "Vary": vary}, "body": ""}
+
+def storage_error_response():
+    return {"statusCode": 503, "body": "Failed to reach storage, please retry."}
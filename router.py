@@ -17,3 +17,20 @@ def route(event: Any, path: str) -> Dict[str, Any] | None:
         response_headers['Set-Cookie'] = 'Signed-In=true; Path=/; Secure; HttpOnly; SameSite=Lax; Max-Age=2592000;'
         response_headers['HX-Refresh'] = 'true'
         return {"statusCode": 204, "headers": response_headers, "body": ""}
+
+    if path.startswith('lyrics/'):
+        # Imported on first use, like the page stack in index
+        from page import render_lyrics
+        return render_lyrics(event, path.removeprefix('lyrics/'))
+
+    if path == 'batch' or path.startswith('batch/'):
+        from page import render_batch
+        return render_batch(event, path.removeprefix('batch').lstrip('/'))
+
+    if path == 'search':
+        from page import render_search
+        return render_search(event)
+
+    if path.startswith('files/'):
+        from page import render_file
+        return render_file(event, path.removeprefix('files/'))
@@ -0,0 +1,208 @@
+"""
+An in-memory index for finding seasons, shows and songs by name, built from
+the library and kept across warm invocations. Each entry is indexed by the
+words of its path: the season (e.g. 24 1, 2024, winter), the show, and for
+songs their name, OP/ED number, and the titles of their lyrics in the
+songMetadata of the folder's metadata.json.
+
+A query matches the entries that have, for each of its words, a word
+starting with it, e.g. `show a op` or `winter 24`.
+"""
+import bisect, heapq, os, re, threading, time, unicodedata
+from functools import partial
+from typing import Any, Iterable
+
+from env import INDEX, SEARCH_TTL
+from utils import season_map, re_season, TransientS3Error, Metadata, run_concurrently, get_song_name
+from catalog import get_catalog, get_metadata, iter_objects
+from entries import display_music_exts, re_song
+
+re_word = re.compile(r"\w+")
+re_season_folder = re.compile(re_season)
+
+def words(text: str) -> list[str]:
+    return re_word.findall(unicodedata.normalize('NFKC', text).casefold())
+
+class SearchIndex:
+    """
+    An inverted index of words to entries, with the words kept sorted for
+    prefix lookups. Entries are song keys and folder prefixes (ending in
+    '/'), each stored with a version, so that a refresh only re-indexes the
+    entries that were added, changed, or whose metadata.json changed.
+
+    Only the first build runs on the request path. Once the index is stale,
+    a search starts a refresh on a background thread and searches the
+    previous index meanwhile.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # entry -> version
+        self.versions: dict[str, str] = {}
+        # entry -> the words it is indexed by
+        self.entry_words: dict[str, list[str]] = {}
+        # word -> entries
+        self.postings: dict[str, set[str]] = {}
+        self.vocabulary: list[str] = []
+        # The catalog ETag that the index was built from, if any
+        self.source: str | None = None
+        self.loaded_at: float | None = None
+        # Held while the index is searched or a refresh applies its changes
+        self.lock = threading.Lock()
+        # Held for the whole of a refresh, so that one runs at a time
+        self.refresh_lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        if self.loaded_at is None:
+            return True
+        if (catalog := get_catalog()) is not None:
+            return catalog.etag != self.source
+        return time.monotonic() - self.loaded_at > self.ttl
+
+    def refresh(self):
+        """
+        Lists the library and re-indexes what changed. Only applying the
+        changes holds the lock, so searches wait for that but not the listing.
+        """
+        catalog = get_catalog()
+        objects = dict(iter_objects(INDEX + '/'))
+
+        metadata_etags = {
+            os.path.dirname(key): etag for key, etag in objects.items()
+            if os.path.basename(key) == 'metadata.json'
+        }
+        versions: dict[str, str] = {}
+        for key, etag in objects.items():
+            folder = os.path.dirname(key)
+            if os.path.splitext(key)[1] in display_music_exts:
+                versions[key] = f"{etag}:{metadata_etags.get(folder, '')}"
+            while folder.startswith(INDEX + '/') and folder + '/' not in versions:
+                versions[folder + '/'] = ''
+                folder = os.path.dirname(folder)
+
+        changed = [entry for entry, version in versions.items() if self.versions.get(entry) != version]
+        removed = self.versions.keys() - versions.keys()
+
+        # Only the metadata.json of folders with changed songs is read
+        folders = sorted({
+            os.path.dirname(entry) for entry in changed
+            if not entry.endswith('/') and os.path.dirname(entry) in metadata_etags
+        })
+        metadata = dict(zip(folders, run_concurrently(*[partial(get_metadata, folder) for folder in folders])))
+        changed_words = {entry: entry_words(entry, metadata.get(os.path.dirname(entry))) for entry in changed}
+
+        with self.lock:
+            for entry in removed:
+                self.remove(entry)
+                del self.versions[entry]
+            for entry, new_words in changed_words.items():
+                self.remove(entry)
+                self.add(entry, new_words)
+                self.versions[entry] = versions[entry]
+            if changed or removed:
+                self.vocabulary = sorted(self.postings)
+
+            self.source = catalog.etag if catalog else None
+            self.loaded_at = time.monotonic()
+
+    def refresh_in_background(self):
+        """Starts a refresh on its own thread, unless one is already running."""
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self.background_refresh, name='search-refresh', daemon=True).start()
+
+    def background_refresh(self):
+        try:
+            self.refresh()
+        except TransientS3Error:
+            # Keep searching the previous index, and retry on the next search
+            pass
+        finally:
+            self.refresh_lock.release()
+
+    def add(self, entry: str, entry_words: Iterable[str]):
+        unique_words = list(dict.fromkeys(entry_words))
+        self.entry_words[entry] = unique_words
+        for word in unique_words:
+            self.postings.setdefault(word, set()).add(entry)
+
+    def remove(self, entry: str):
+        for word in self.entry_words.pop(entry, []):
+            postings = self.postings[word]
+            postings.discard(entry)
+            if not postings:
+                del self.postings[word]
+
+    def search(self, query: str, limit: int) -> list[str]:
+        """
+        Returns up to `limit` matching entries: seasons, then shows, then songs.
+        TransientS3Error propagates if the first build of the index fails.
+        """
+        if not (query_words := words(query)):
+            return []
+
+        if self.loaded_at is None:
+            with self.refresh_lock:
+                # Another search may have built it while this one waited
+                if self.loaded_at is None:
+                    self.refresh()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+        with self.lock:
+            matches: set[str] | None = None
+            # Longer words tend to match fewer entries, which keeps the intersection small
+            for word in sorted(set(query_words), key=len, reverse=True):
+                word_matches: set[str] = set()
+                i = bisect.bisect_left(self.vocabulary, word)
+                while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+                    word_matches |= self.postings[self.vocabulary[i]]
+                    i += 1
+                matches = word_matches if matches is None else matches & word_matches
+                if not matches:
+                    return []
+
+        return heapq.nsmallest(limit, matches, key=entry_order)
+
+def entry_order(entry: str) -> tuple[bool, int, str]:
+    return (not entry.endswith('/'), entry.count('/'), entry)
+
+def entry_words(entry: str, metadata: Metadata | None) -> list[str]:
+    """The words that an entry is found by."""
+    entry_words: list[str] = []
+    components = entry.rstrip('/').removeprefix(INDEX + '/').split('/')
+    name = components.pop() if not entry.endswith('/') else None
+
+    for component in components:
+        if season_match := re_season_folder.fullmatch(component):
+            year, season = int(season_match.group(1)), int(season_match.group(2))
+            entry_words += [f'{year:02d}', f'20{year:02d}', str(season), season_map[season].casefold()]
+        else:
+            entry_words += words(component)
+
+    if name:
+        stem = os.path.splitext(name)[0]
+        if song_match := re_song.match(stem):
+            song_type, song_number, song_name = song_match.groups()
+            entry_words += [song_type.casefold(), f'{song_type}{song_number or ""}'.casefold()]
+            entry_words += words(song_name)
+        else:
+            entry_words += words(stem)
+        entry_words += song_metadata_words(metadata, get_song_name(entry))
+
+    return entry_words
+
+def song_metadata_words(metadata: Metadata | None, song_name: str) -> list[str]:
+    """The words of the titles of a song's lyrics, in each of their languages."""
+    if not metadata or not isinstance(songs := metadata.get('songMetadata'), dict):
+        return []
+    song_metadata: Any = songs.get(song_name)
+    if not isinstance(song_metadata, dict):
+        return []
+
+    metadata_words: list[str] = []
+    for lyrics in (song_metadata.get('lyrics') or {}).values():
+        if isinstance(lyrics, dict) and isinstance(title := lyrics.get('title'), str):
+            metadata_words += words(title)
+    return metadata_words
+
+search_index = SearchIndex(SEARCH_TTL)
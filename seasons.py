@@ -0,0 +1,67 @@
+import bisect, re, threading, time
+
+from env import INDEX, SEASON_TTL
+from utils import re_season, TransientS3Error, fingerprint
+from catalog import get_folder
+
+class SeasonIndex:
+    """
+    Sorted periods (year * 4 + season - 1) of every populated season folder,
+    built from a single delimiter listing of the index folder and kept for
+    `ttl` seconds across warm invocations. One thread refreshes it at a time.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.periods: list[int] = []
+        self.fingerprint = ''
+        self.loaded_at: float | None = None
+        self.lock = threading.Lock()
+        self.re_folder = re.compile(rf"{re.escape(INDEX)}/{re_season}/")
+
+    def refresh(self):
+        periods = set()
+        try:
+            for key in get_folder(INDEX) or []:
+                if match := self.re_folder.fullmatch(key):
+                    periods.add(to_period(int(match.group(1)), int(match.group(2))))
+        except TransientS3Error:
+            # Keep the previous periods and retry on the next lookup
+            return
+
+        sorted_periods = sorted(periods)
+        self.fingerprint = fingerprint(*map(str, sorted_periods))
+        self.periods = sorted_periods
+        self.loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def get_periods(self) -> list[int]:
+        if self.is_stale():
+            with self.lock:
+                # Another thread may have refreshed it while this one waited
+                if self.is_stale():
+                    self.refresh()
+        return self.periods
+
+    def get_fingerprint(self) -> str:
+        self.get_periods()
+        return self.fingerprint
+
+    def previous(self, period: int) -> int | None:
+        periods = self.get_periods()
+        i = bisect.bisect_left(periods, period)
+        return periods[i - 1] if i > 0 else None
+
+    def next(self, period: int) -> int | None:
+        periods = self.get_periods()
+        i = bisect.bisect_right(periods, period)
+        return periods[i] if i < len(periods) else None
+
+def to_period(year: int, season: int) -> int:
+    return year * 4 + (season - 1) % 4
+
+def format_period(period: int) -> str:
+    return f'{period // 4}-{(period % 4) + 1}'
+
+season_index = SeasonIndex(SEASON_TTL)
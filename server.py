@@ -0,0 +1,300 @@
+"""
+Serves index.handler over plain HTTP, for running the player on a LAN box or
+load testing it locally. Each request becomes an API Gateway proxy event, so
+the S3 client, templates and caches stay in memory across requests.
+
+    python server.py [--host 0.0.0.0] [--port 8000] [--workers 16]
+
+Requests are served under the path of PLAYER_URL, e.g. /player. Files of a
+PLAYER_LOCAL_ROOT library, and byte ranges of them, are sent with sendfile.
+Full pages are streamed with chunked transfer encoding as they render.
+
+Connections are kept alive. Each request is served by one of the worker
+threads, and a single thread waits on the connections that have not sent a
+request yet, whether new or between requests, so --workers bounds the
+requests served at once rather than the connections open. SIGTERM or Ctrl-C
+stops accepting connections and lets in-flight requests finish.
+"""
+import argparse, base64, os, selectors, signal, socket, threading, time, traceback, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Iterator
+
+from env import URL
+from streaming import StreamedFile
+import index
+
+# Seconds that an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 15
+# Seconds that shutdown waits for in-flight requests
+SHUTDOWN_TIMEOUT = 30
+
+BASE_PATH = urllib.parse.urlsplit(URL).path.rstrip('/')
+
+def to_event(method: str, target: str, headers: dict[str, str]) -> dict | None:
+    """
+    Returns the API Gateway proxy event of a request, or None if its path is
+    outside of BASE_PATH.
+    """
+    split = urllib.parse.urlsplit(target)
+    if split.path != BASE_PATH and not split.path.startswith(BASE_PATH + '/'):
+        return None
+
+    query: dict[str, list[str]] = urllib.parse.parse_qs(split.query, keep_blank_values=True)
+    return {
+        'httpMethod': method,
+        'path': split.path,
+        # Still quoted, as API Gateway passes it
+        'pathParameters': {'proxy': split.path[len(BASE_PATH):].lstrip('/')},
+        'headers': headers,
+        'queryStringParameters': {name: values[-1] for name, values in query.items()} or None,
+        'multiValueQueryStringParameters': query or None,
+        'body': None,
+        'isBase64Encoded': False,
+        # Lets files be returned as a StreamedFile, which is sent with sendfile,
+        # and pages as a generator of chunks, which are sent as they render
+        'requestContext': {'sendfile': True, 'streaming': True},
+    }
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the requests of one connection. Unlike BaseHTTPRequestHandler, it
+    does not loop over them: PooledHTTPServer calls handle_one_request for
+    each request, so that no worker waits on the connection in between.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def __init__(self, request: socket.socket, client_address, server: 'PooledHTTPServer'):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def has_buffered_request(self) -> bool:
+        """Whether the client already sent more than the last request, which the socket won't signal."""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body: bool):
+        # Request bodies are not used, but must be read to keep the connection usable
+        if length := int(self.headers.get('Content-Length') or 0):
+            self.rfile.read(length)
+
+        event = to_event(self.command, self.path, dict(self.headers.items()))
+        if event is None:
+            response = {"statusCode": 404, "body": "Not found."}
+        else:
+            try:
+                response = index.handler(event, None)
+                if response.get('chunks') is not None and self.request_version != 'HTTP/1.1':
+                    # Chunked transfer encoding is HTTP/1.1 only
+                    response = {**response, 'chunks': None, 'body': b''.join(response['chunks'])}
+            except Exception:
+                traceback.print_exc()
+                response = {"statusCode": 500, "body": "Internal error."}
+
+        stream: StreamedFile | None = response.get('stream')
+        chunks: Iterator[bytes] | None = response.get('chunks')
+        body = response.get('body') or ''
+        if isinstance(body, bytes):
+            data = body
+        else:
+            data = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode('utf-8')
+
+        self.send_response(response['statusCode'])
+        if self.server.stopping.is_set():
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        for name, value in (response.get('headers') or {}).items():
+            self.send_header(name, str(value))
+        if 'Content-Type' not in (response.get('headers') or {}) and data:
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        if chunks is not None:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(stream.size() if stream else len(data)))
+        self.end_headers()
+        if not send_body:
+            return
+        if chunks is not None:
+            self.send_chunks(chunks)
+        elif stream:
+            stream.send(self.connection)
+        elif data:
+            self.wfile.write(data)
+
+    def send_chunks(self, chunks: Iterator[bytes]):
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        except Exception:
+            # The status is already sent, so the client can only tell from the missing last chunk.
+            # Pages only render from what was fetched before the status, so this is a bug, not storage.
+            traceback.print_exc()
+            self.close_connection = True
+            return
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        # The handler already logs a metrics line per request
+        pass
+
+class IdleConnections:
+    """
+    Waits on new connections, and on kept-alive ones between their requests,
+    on one thread. A connection that becomes readable is handed to `on_ready`, and
+    one that stays idle for `timeout` seconds to `on_close`.
+    """
+    def __init__(self, timeout: float, on_ready: Callable[[RequestHandler], Any], on_close: Callable[[RequestHandler], Any]):
+        self.timeout = timeout
+        self.on_ready = on_ready
+        self.on_close = on_close
+        self.selector = selectors.DefaultSelector()
+        # Connections are registered by the selector's thread, which this wakes up
+        self.waker, self.wakeup = socket.socketpair()
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        self.added: list[RequestHandler] = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='http-idle', daemon=True)
+        self.thread.start()
+
+    def add(self, handler: RequestHandler):
+        with self.lock:
+            if not self.closed:
+                self.added.append(handler)
+                self.wakeup.send(b'\0')
+                return
+        self.on_close(handler)
+
+    def run(self):
+        # connection -> monotonic time that it is closed at
+        deadlines: dict[RequestHandler, float] = {}
+        while True:
+            with self.lock:
+                added, self.added = self.added, []
+                closed = self.closed
+            if closed:
+                break
+            for handler in added:
+                self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+                deadlines[handler] = time.monotonic() + self.timeout
+
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    self.waker.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                del deadlines[key.data]
+                self.on_ready(key.data)
+
+            now = time.monotonic()
+            for handler, deadline in list(deadlines.items()):
+                if deadline <= now:
+                    self.selector.unregister(handler.connection)
+                    del deadlines[handler]
+                    self.on_close(handler)
+
+        for handler in [*deadlines, *added]:
+            self.on_close(handler)
+        self.selector.close()
+        self.waker.close()
+        self.wakeup.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.send(b'\0')
+        self.thread.join()
+
+class PooledHTTPServer(HTTPServer):
+    """
+    An HTTPServer that serves requests on a fixed pool of worker threads,
+    instead of a thread per connection. Idle connections wait in
+    IdleConnections, not on a worker.
+    """
+    def __init__(self, address: tuple[str, int], workers: int):
+        super().__init__(address, RequestHandler)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+        self.idle = IdleConnections(KEEP_ALIVE_TIMEOUT, on_ready=self.submit, on_close=self.close_connection)
+        # Set once shutdown starts, so that kept-alive connections are closed after their current request
+        self.stopping = threading.Event()
+
+    def process_request(self, request: socket.socket, client_address):
+        # A new connection only takes a worker once it sends something, as preconnected ones may never
+        self.idle.add(RequestHandler(request, client_address, self))
+
+    def submit(self, handler: RequestHandler):
+        self.executor.submit(self.serve_request, handler)
+
+    def serve_request(self, handler: RequestHandler):
+        """Serves the next request of a connection, then returns the connection to the idle ones or closes it."""
+        try:
+            handler.close_connection = True
+            handler.handle_one_request()
+            if not handler.close_connection and not self.stopping.is_set():
+                if handler.has_buffered_request():
+                    self.submit(handler)
+                else:
+                    self.idle.add(handler)
+                return
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+        self.close_connection(handler)
+
+    def close_connection(self, handler: RequestHandler):
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def server_close(self):
+        super().server_close()
+        self.idle.close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+def serve(host: str, port: int, workers: int):
+    server = PooledHTTPServer((host, port), workers)
+
+    def stop(signum, _):
+        if server.stopping.is_set():
+            return
+        server.stopping.set()
+        print(f"Received signal {signum}, finishing in-flight requests", flush=True)
+        # shutdown() waits for serve_forever(), which is running on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        # Requests still running after the timeout are abandoned
+        timer = threading.Timer(SHUTDOWN_TIMEOUT, os._exit, args=(1,))
+        timer.daemon = True
+        timer.start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving {URL} on http://{host}:{port}{BASE_PATH}/ with {workers} workers", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
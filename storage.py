@@ -0,0 +1,170 @@
+"""
+Where the library is read from: the S3 bucket, or a local mirror of it when
+PLAYER_LOCAL_ROOT is set. Keys are the same in both, e.g.
+`index/24-1/Show/OP 1 FULL Song.mp3`.
+"""
+import os, json
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+from env import URL, LOCAL_ROOT, METADATA_CACHE_SIZE
+from cache import LRUCache
+from utils import (
+    ItemType, FolderListing, Metadata, fingerprint, encode_path_components,
+    get_s3_folder, get_s3_metadata, resolve_path, get_presigned_url, get_presigned_urls,
+    iter_s3_listing,
+)
+
+class Storage(ABC):
+    """The library operations that pages need."""
+    @abstractmethod
+    def get_folder(self, path: str) -> FolderListing | None:
+        """
+        Returns the folder's keys and sub-folder prefixes (ending in '/'),
+        or None for an empty or non-existent folder.
+        """
+
+    @abstractmethod
+    def resolve(self, path: str) -> ItemType:
+        """Returns whether the path is a file, a folder, or missing."""
+
+    @abstractmethod
+    def iter_objects(self, prefix: str) -> Iterator[tuple[str, str]]:
+        """Yields the (key, ETag) of every object under a prefix, in no particular order."""
+
+    def file_exists(self, path: str) -> bool:
+        return self.resolve(path) == ItemType.FILE
+
+    @abstractmethod
+    def get_metadata(self, path: str) -> Metadata | None:
+        """Returns the folder's parsed metadata.json, if it has a valid one."""
+
+    @abstractmethod
+    def url_for(self, key: str, window: int | None = None) -> str:
+        """Returns a URL that the browser can load the object from."""
+
+    def urls_for(self, keys: list[str], window: int | None = None) -> list[str]:
+        return [self.url_for(key, window) for key in keys]
+
+class S3Storage(Storage):
+    def get_folder(self, path: str) -> FolderListing | None:
+        return get_s3_folder(path)
+
+    def resolve(self, path: str) -> ItemType:
+        return resolve_path(path)
+
+    def iter_objects(self, prefix: str) -> Iterator[tuple[str, str]]:
+        for response in iter_s3_listing(prefix, delimiter=None):
+            for obj in response.get('Contents', []):
+                yield obj['Key'], obj['ETag']
+
+    def get_metadata(self, path: str) -> Metadata | None:
+        return get_s3_metadata(path)
+
+    def url_for(self, key: str, window: int | None = None) -> str:
+        return get_presigned_url(key, window)
+
+    def urls_for(self, keys: list[str], window: int | None = None) -> list[str]:
+        return get_presigned_urls(keys, window)
+
+class LocalStorage(Storage):
+    """
+    A mirror of the bucket in a local directory. Objects are served by the
+    files/ route, and each metadata.json is parsed again only when its
+    modification time or size changes.
+    """
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        # folder path -> parsed metadata.json, versioned by (mtime_ns, size)
+        self.metadata = LRUCache(METADATA_CACHE_SIZE, sizeof=lambda metadata: metadata.size)
+
+    def local_path(self, key: str) -> str | None:
+        """Returns the file path of a key, or None if it would leave the root."""
+        local_path = os.path.normpath(os.path.join(self.root, key))
+        if local_path != self.root and not local_path.startswith(self.root + os.sep):
+            return None
+        return local_path
+
+    def get_folder(self, path: str) -> FolderListing | None:
+        if (local_path := self.local_path(path)) is None:
+            return None
+        files: list[tuple[str, str]] = []
+        folders: list[str] = []
+        try:
+            with os.scandir(local_path) as entries:
+                for entry in entries:
+                    key = f'{path}/{entry.name}' if path else entry.name
+                    if entry.is_dir():
+                        folders.append(key + '/')
+                    else:
+                        files.append((key, stat_etag(entry.stat())))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        # Ordered as a delimiter listing returns them
+        files.sort()
+        folders.sort()
+        listing = FolderListing([key for key, _ in files] + folders)
+        if not listing:
+            return None
+        listing.fingerprint = fingerprint(
+            *[part for file in files for part in file],
+            *[part for folder in folders for part in (folder, '')],
+        )
+        return listing
+
+    def resolve(self, path: str) -> ItemType:
+        if not path or (local_path := self.local_path(path)) is None:
+            return ItemType.MISSING
+        if os.path.isfile(local_path):
+            return ItemType.FILE
+        if os.path.isdir(local_path):
+            return ItemType.FOLDER
+        return ItemType.MISSING
+
+    def iter_objects(self, prefix: str) -> Iterator[tuple[str, str]]:
+        folder = prefix.rstrip('/')
+        if (local_path := self.local_path(folder)) is None:
+            return
+        try:
+            with os.scandir(local_path) as entries:
+                entries = list(entries)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in entries:
+            key = f'{folder}/{entry.name}' if folder else entry.name
+            if entry.is_dir():
+                yield from self.iter_objects(key)
+            else:
+                yield key, stat_etag(entry.stat())
+
+    def get_metadata(self, path: str) -> Metadata | None:
+        if (local_path := self.local_path(f'{path}/metadata.json')) is None:
+            return None
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            self.metadata.delete(path)
+            return None
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        if (cached := self.metadata.get(path, version)) is not None:
+            return cached
+
+        try:
+            with open(local_path, 'rb') as metadata_file:
+                metadata = Metadata(json.load(metadata_file))
+        except (OSError, ValueError):
+            return None
+        metadata.etag = stat_etag(stat)
+        metadata.size = stat.st_size
+        self.metadata.set(path, metadata, version)
+        return metadata
+
+    def url_for(self, key: str, window: int | None = None) -> str:
+        return f'{URL}/files/{encode_path_components(key)}'
+
+def stat_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+storage: Storage = LocalStorage(LOCAL_ROOT) if LOCAL_ROOT else S3Storage()
@@ -0,0 +1,127 @@
+"""
+Byte-range responses for files of a local library, as browsers need them to
+seek in audio. The body is planned as slices of the file, so that the server
+can send them with sendfile and Lambda can copy only the requested bytes.
+"""
+import mmap, os, re, socket, uuid
+from email.utils import formatdate
+
+# Requests for more ranges than this are answered with the whole file
+MAX_RANGES = 16
+
+re_range_spec = re.compile(r"\s*(\d*)\s*-\s*(\d*)\s*")
+
+class StreamedFile:
+    """A response body made of literal bytes and (offset, length) slices of one file."""
+    __slots__ = ('path', 'segments')
+
+    def __init__(self, path: str, segments: list[bytes | tuple[int, int]]):
+        self.path = path
+        self.segments = segments
+
+    def size(self) -> int:
+        return sum([len(segment) if isinstance(segment, bytes) else segment[1] for segment in self.segments])
+
+    def read(self) -> bytes:
+        """Returns the body, mapping the file instead of reading all of it."""
+        if not any(isinstance(segment, tuple) and segment[1] for segment in self.segments):
+            return b''.join([segment for segment in self.segments if isinstance(segment, bytes)])
+        with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return b''.join([
+                segment if isinstance(segment, bytes) else mapped[segment[0]:segment[0] + segment[1]]
+                for segment in self.segments
+            ])
+
+    def send(self, connection: socket.socket):
+        """Writes the body to a socket, with the file slices sent by the kernel."""
+        with open(self.path, 'rb') as file:
+            for segment in self.segments:
+                if isinstance(segment, bytes):
+                    connection.sendall(segment)
+                elif segment[1]:
+                    connection.sendfile(file, segment[0], segment[1])
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Returns the (offset, length) of each satisfiable range of a Range header,
+    or None when the header is malformed or asks for too many ranges, in
+    which case the whole file is sent.
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        if not (match := re_range_spec.fullmatch(spec)):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        elif last:
+            # A suffix: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            return None
+        if start < size and start <= end:
+            ranges.append((start, end - start + 1))
+    return ranges
+
+def stream_file(
+    path: str,
+    stat: os.stat_result,
+    etag: str,
+    content_type: str,
+    request_headers: dict[str, str],
+    response_headers: dict[str, str],
+) -> tuple[int, StreamedFile]:
+    """
+    Plans the response to a request for a file, honouring Range and If-Range.
+    Returns the status code and body, and adds the response headers.
+    """
+    size = stat.st_size
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    response_headers['Accept-Ranges'] = 'bytes'
+    response_headers['Last-Modified'] = last_modified
+
+    ranges = None
+    if range_header := request_headers.get('range'):
+        if_range = request_headers.get('if-range', '').strip()
+        # A range of a different version of the file would be corrupt
+        if not if_range or if_range in (etag, last_modified):
+            ranges = parse_range(range_header, size)
+
+    if ranges is None:
+        response_headers['Content-Type'] = content_type
+        return 200, StreamedFile(path, [(0, size)])
+
+    if not ranges:
+        response_headers['Content-Range'] = f'bytes */{size}'
+        return 416, StreamedFile(path, [])
+
+    if len(ranges) == 1:
+        offset, length = ranges[0]
+        response_headers['Content-Type'] = content_type
+        response_headers['Content-Range'] = f'bytes {offset}-{offset + length - 1}/{size}'
+        return 206, StreamedFile(path, [(offset, length)])
+
+    boundary = uuid.uuid4().hex
+    segments: list[bytes | tuple[int, int]] = []
+    for offset, length in ranges:
+        segments.append((
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {offset}-{offset + length - 1}/{size}\r\n\r\n'
+        ).encode('ascii'))
+        segments.append((offset, length))
+        segments.append(b'\r\n')
+    segments.append(f'--{boundary}--\r\n'.encode('ascii'))
+    response_headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    return 206, StreamedFile(path, segments)
@@ -0,0 +1,129 @@
+import os, re
+from typing import Callable, Iterator
+
+from env import URL
+from utils import fingerprint
+from compression import Static, Part
+
+LazyPart = Part | Callable[[], Part]
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_FILES = [
+    'index.html',
+    'password.html',
+    'player.html',
+    'playlist.html',
+    'search.html',
+    'loadPlayer.js',
+    'loadMusic.js',
+    'loadPlaylist.js',
+    'index.css',
+]
+# Modules whose code shapes the rendered pages
+RENDER_MODULES = ['page.py', 'entries.py', 'templates.py', 'utils.py']
+
+re_placeholder = re.compile(r"\{\{ (\w+) \}\}")
+
+def strip_lines(text: str) -> str:
+    """
+    Removes leading whitespace from each line. Blank lines and a trailing
+    newline are kept so that stripped pieces can be concatenated.
+    """
+    return '\n'.join([line.lstrip() for line in text.split('\n')])
+
+class Template:
+    """
+    A template split into literal segments around its `{{ name }}` slots,
+    so that rendering is a single join. The segments are also kept as Static
+    parts, so that they are only compressed once.
+    """
+    __slots__ = ('segments', 'static_segments', 'slots')
+
+    def __init__(self, text: str):
+        parts = re_placeholder.split(text)
+        self.segments: list[str] = parts[0::2]
+        self.static_segments = [Static(segment) for segment in self.segments]
+        self.slots: list[str] = parts[1::2]
+
+    def render(self, /, **values: str) -> str:
+        segments = self.segments
+        parts = [segments[0]]
+        for i, slot in enumerate(self.slots):
+            parts.append(values[slot])
+            parts.append(segments[i + 1])
+        return ''.join(parts)
+
+    def parts(self, /, **values: Part | list[Part]) -> list[Part]:
+        segments = self.static_segments
+        parts: list[Part] = [segments[0]]
+        for i, slot in enumerate(self.slots):
+            value = values[slot]
+            if isinstance(value, list):
+                parts += value
+            else:
+                parts.append(value)
+            parts.append(segments[i + 1])
+        return parts
+
+    def iter_parts(self, /, **values: LazyPart | list[LazyPart]) -> Iterator[Part]:
+        """
+        Yields the parts in order. A value, or an item of a list value, that is
+        a function is only called when its slot is reached, so that the parts
+        before it can be sent while it renders.
+        """
+        segments = self.static_segments
+        yield segments[0]
+        for i, slot in enumerate(self.slots):
+            value = values[slot]
+            for item in value if isinstance(value, list) else [value]:
+                yield item() if callable(item) else item
+            yield segments[i + 1]
+
+registry: dict[str, Template] = {}
+
+def register(name: str, text: str) -> Template:
+    template = registry[name] = Template(strip_lines(text))
+    return template
+
+def render(template_name: str, /, **values: str) -> str:
+    return registry[template_name].render(**values)
+
+def parts(template_name: str, /, **values: Part | list[Part]) -> list[Part]:
+    return registry[template_name].parts(**values)
+
+def iter_parts(template_name: str, /, **values: LazyPart | list[LazyPart]) -> Iterator[Part]:
+    return registry[template_name].iter_parts(**values)
+
+def _read(name: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, name)) as template_file:
+        return template_file.read()
+
+for _name in TEMPLATE_FILES:
+    register(_name, _read(_name))
+
+# Changes whenever a template or the code rendering them is redeployed, for ETags
+version = fingerprint(*[_read(name) for name in TEMPLATE_FILES + RENDER_MODULES])
+
+# Composed templates, with the static assets already inlined
+register('audio', f"""\
+<div
+    id="audio" hx-swap-oob="true"
+    class="md:max-w-lg flex flex-col items-center gap-2"
+    style="min-width:50%"
+>
+    <p id="name"></p>
+
+    {render('player.html')}
+    {{{{ content }}}}
+
+    <script id="load-player" hx-preserve type="text/javascript">
+    {render('loadPlayer.js')}
+    </script>
+</div>
+""")
+
+css = Static(render('index.css'))
+playlist = Static(render('playlist.html'))
+search = Static(render('search.html', url=URL))
+load_playlist = Static(f'<script id="load-playlist-tabs">{render("loadPlaylist.js", url=URL)}</script>')
+password = Static(render('password.html', url=URL))
@@ -0,0 +1,15 @@
+"""
+Unit tests, run from the repository root with:
+
+    python -m unittest
+
+The modules read their settings from the environment when they are first
+imported, so the settings that the tests rely on are set here, before any
+test imports them.
+"""
+import os
+
+os.environ.setdefault('PLAYER_INDEX', 'index')
+os.environ.setdefault('PLAYER_URL', 'https://example.com/player')
+# No catalog manifest, so that nothing looks one up in S3
+os.environ.setdefault('PLAYER_CATALOG', '')
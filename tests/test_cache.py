@@ -0,0 +1,79 @@
+import threading, unittest
+
+from cache import LRUCache
+
+class LRUCacheTest(unittest.TestCase):
+    def test_get_returns_what_was_set(self):
+        cache = LRUCache(100)
+        cache.set('a', 'value')
+        self.assertEqual(cache.get('a'), 'value')
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_other_version_drops_the_entry(self):
+        cache = LRUCache(100)
+        cache.set('a', 'value', version=1)
+        self.assertIsNone(cache.get('a', version=2))
+        # Dropped, so the old version misses too
+        self.assertIsNone(cache.get('a', version=1))
+        self.assertEqual(cache.size, 0)
+
+    def test_evicts_least_recently_used_by_size(self):
+        cache = LRUCache(10)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        cache.get('a')
+        cache.set('c', 'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'aaaa')
+        self.assertEqual(cache.get('c'), 'cccc')
+        self.assertEqual(cache.size, 8)
+
+    def test_replacing_an_entry_updates_the_size(self):
+        cache = LRUCache(10)
+        cache.set('a', 'aaaa')
+        cache.set('a', 'aa')
+        self.assertEqual(cache.size, 2)
+
+    def test_values_larger_than_the_cache_are_not_kept(self):
+        cache = LRUCache(4)
+        cache.set('a', 'a' * 5)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_sizeof(self):
+        cache = LRUCache(2, sizeof=lambda _: 1)
+        for key in 'abc':
+            cache.set(key, [key] * 100)
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache(10)
+        cache.set('a', 'aa')
+        cache.set('b', 'bb')
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 2)
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 0)
+
+    def test_concurrent_eviction(self):
+        cache = LRUCache(50, sizeof=lambda _: 1)
+
+        def fill(thread: int):
+            for i in range(2000):
+                cache.set((thread, i), i)
+                cache.get((thread, i - 1))
+
+        threads = [threading.Thread(target=fill, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.size, 50)
+        self.assertEqual(len(cache.entries), 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import gzip, struct, unittest, zlib
+
+import compression
+from compression import Static, negotiate, compress_parts, encode_parts, join_parts, stream_parts
+
+def page_parts() -> list:
+    head = Static('<html><head><title>Seasons Music</title></head><body>\n' * 20)
+    tail = Static('</body></html>\n')
+    return [head, 'dynamic ', '', 'text é\n' * 100, head, tail, 'after the tail']
+
+class NegotiateTest(unittest.TestCase):
+    def test_gzip(self):
+        self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+
+    def test_none_acceptable(self):
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('deflate, identity'))
+        self.assertIsNone(negotiate('gzip;q=0'))
+        self.assertIsNone(negotiate('*;q=0'))
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate('*'), compression.available_encodings[0])
+
+    def test_highest_q_value_wins(self):
+        if 'zstd' not in compression.available_encodings:
+            self.skipTest('zstandard is not installed')
+        self.assertEqual(negotiate('zstd;q=0.5, gzip;q=0.9'), 'gzip')
+        self.assertEqual(negotiate('zstd, gzip'), 'zstd')
+
+    def test_malformed_q_value(self):
+        self.assertIsNone(negotiate('gzip;q=high'))
+        self.assertEqual(negotiate(' GZIP ; Q=1 '), 'gzip')
+
+class CompressPartsTest(unittest.TestCase):
+    def test_gzip_splices_to_the_joined_page(self):
+        parts = page_parts()
+        body = compress_parts(parts, 'gzip')
+        # gzip.decompress checks the CRC and size of the trailer
+        self.assertEqual(gzip.decompress(body).decode('utf-8'), join_parts(parts))
+
+    def test_static_parts_are_compressed_once(self):
+        head = Static('<head></head>')
+        first = head.compress('gzip')
+        compress_parts([head, 'x', head], 'gzip')
+        self.assertIs(head.compress('gzip'), first)
+
+    def test_only_static_or_only_dynamic(self):
+        for parts in ([Static('a' * 50)], ['b' * 50], ['']):
+            self.assertEqual(gzip.decompress(compress_parts(parts, 'gzip')).decode('utf-8'), join_parts(parts))
+
+    def test_zstd_frames(self):
+        if compression.zstandard is None:
+            self.skipTest('zstandard is not installed')
+        parts = page_parts()
+        body = compress_parts(parts, 'zstd')
+        reader = compression.zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+        self.assertEqual(reader.read().decode('utf-8'), join_parts(parts))
+
+    def test_brotli(self):
+        if compression.brotli is None:
+            self.skipTest('brotli is not installed')
+        parts = page_parts()
+        self.assertEqual(compression.brotli.decompress(compress_parts(parts, 'br')).decode('utf-8'), join_parts(parts))
+
+class EncodePartsTest(unittest.TestCase):
+    def test_compresses_with_the_negotiated_encoding(self):
+        parts = page_parts()
+        body, encoding = encode_parts(parts, 'gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body).decode('utf-8'), join_parts(parts))
+
+    def test_small_pages_are_sent_as_text(self):
+        body, encoding = encode_parts([Static('<p>'), 'small', Static('</p>')], 'gzip')
+        self.assertIsNone(encoding)
+        self.assertEqual(body, '<p>small</p>')
+
+    def test_no_acceptable_encoding(self):
+        parts = page_parts()
+        self.assertEqual(encode_parts(parts, 'identity'), (join_parts(parts), None))
+
+class StreamPartsTest(unittest.TestCase):
+    def test_gzip_stream_is_the_joined_page(self):
+        parts = page_parts()
+        chunks = list(stream_parts(parts, 'gzip'))
+        self.assertEqual(chunks[0], compression.GZIP_HEADER)
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode('utf-8'), join_parts(parts))
+
+    def test_gzip_trailer(self):
+        parts = page_parts()
+        data = join_parts(parts).encode('utf-8')
+        trailer = list(stream_parts(parts, 'gzip'))[-1]
+        self.assertTrue(trailer.startswith(compression.DEFLATE_END))
+        self.assertEqual(struct.unpack('<II', trailer[-8:]), (zlib.crc32(data), len(data)))
+
+    def test_gzip_stream_matches_the_buffered_body(self):
+        parts = page_parts()
+        self.assertEqual(b''.join(stream_parts(parts, 'gzip')), compress_parts(parts, 'gzip'))
+
+    def test_uncompressed(self):
+        parts = page_parts()
+        self.assertEqual(b''.join(stream_parts(parts, None)), join_parts(parts).encode('utf-8'))
+
+    def test_chunks_are_sent_before_the_parts_run_out(self):
+        consumed = []
+
+        def parts():
+            for i in range(4):
+                consumed.append(i)
+                yield Static(f'<section {i}>')
+                yield 'x' * compression.STREAM_CHUNK_SIZE
+
+        stream = stream_parts(parts(), 'gzip')
+        next(stream)
+        next(stream)
+        self.assertEqual(consumed, [0])
+        # The text of each part is sent as soon as STREAM_CHUNK_SIZE of it is buffered, so what is
+        # left is that text, the other 3 parts' static and text chunks, and the trailer
+        self.assertEqual(len(list(stream)), 1 + 3 * 2 + 1)
+
+    def test_zstd_stream(self):
+        if compression.zstandard is None:
+            self.skipTest('zstandard is not installed')
+        parts = page_parts()
+        body = b''.join(stream_parts(parts, 'zstd'))
+        reader = compression.zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+        self.assertEqual(reader.read().decode('utf-8'), join_parts(parts))
+
+    def test_brotli_stream(self):
+        if compression.brotli is None:
+            self.skipTest('brotli is not installed')
+        parts = page_parts()
+        body = b''.join(stream_parts(parts, 'br'))
+        self.assertEqual(compression.brotli.decompress(body).decode('utf-8'), join_parts(parts))
+
+if __name__ == '__main__':
+    unittest.main()
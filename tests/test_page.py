@@ -0,0 +1,34 @@
+import unittest
+
+from page import get_etag, etag_matches
+
+class EtagTest(unittest.TestCase):
+    def test_etag_is_weak(self):
+        self.assertRegex(get_etag('index', 'FOLDER'), r'^W/"[0-9a-f]{24}"$')
+
+    def test_etag_changes_with_each_part(self):
+        etag = get_etag('index', 'FOLDER', 'listing')
+        self.assertEqual(etag, get_etag('index', 'FOLDER', 'listing'))
+        self.assertNotEqual(etag, get_etag('index', 'FOLDER', 'other listing'))
+        # Parts are separated, so moving text between them changes the tag
+        self.assertNotEqual(get_etag('ab', 'c'), get_etag('a', 'bc'))
+
+    def test_matches_weak_and_strong_forms(self):
+        etag = get_etag('index')
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(etag.removeprefix('W/'), etag))
+
+    def test_matches_any_tag_of_a_list(self):
+        etag = get_etag('index')
+        self.assertTrue(etag_matches(f'"other", {etag} , "another"', etag))
+        self.assertTrue(etag_matches(' * ', etag))
+
+    def test_no_match(self):
+        etag = get_etag('index')
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches('', etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(get_etag('other'), etag))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import threading, unittest
+from unittest import mock
+
+import search
+from search import SearchIndex, words
+from utils import Metadata, TransientS3Error
+
+SHOW_A = 'index/24-1/Show A'
+SONG_ONE = f'{SHOW_A}/OP 1 FULL Song One.mp3'
+SONG_TWO = f'{SHOW_A}/ED FULL Song Two.mp3'
+SHOW_B = 'index/24-3/Show B'
+OTHER = f'{SHOW_B}/OP FULL Other.m4a'
+
+class Library:
+    """The objects and metadata.json files that the index is built from."""
+    def __init__(self):
+        self.objects = {
+            SONG_ONE: '"1"',
+            SONG_TWO: '"2"',
+            f'{SHOW_A}/metadata.json': '"m1"',
+            f'{SHOW_A}/cover.jpg': '"c"',
+            OTHER: '"3"',
+            f'{SHOW_B}/metadata.json': '"m2"',
+        }
+        self.metadata = {
+            SHOW_A: Metadata({'songMetadata': {
+                'Song One': {'lyrics': {'kanji': {'title': '歌'}, 'romaji': {'title': 'Uta'}}},
+                'Song Two': 'malformed',
+            }}),
+            # Metadata accepts a songMetadata that is not an object, and so must the index
+            SHOW_B: Metadata({'songMetadata': ['malformed']}),
+        }
+        self.metadata_reads: list[str] = []
+        self.fail = False
+        # Cleared to hold listings until it is set again
+        self.listing_allowed = threading.Event()
+        self.listing_allowed.set()
+
+    def iter_objects(self, prefix: str):
+        self.listing_allowed.wait()
+        if self.fail:
+            raise TransientS3Error('list_objects_v2 failed')
+        return iter(list(self.objects.items()))
+
+    def get_metadata(self, path: str):
+        self.metadata_reads.append(path)
+        return self.metadata.get(path)
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.library = Library()
+        for name, value in (
+            ('iter_objects', self.library.iter_objects),
+            ('get_metadata', self.library.get_metadata),
+            ('get_catalog', lambda: None),
+        ):
+            patcher = mock.patch.object(search, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.index = SearchIndex(ttl=300)
+
+    def wait_for_refresh(self):
+        # Held by a background refresh until it finishes
+        with self.index.refresh_lock:
+            pass
+
+    def test_words(self):
+        self.assertEqual(words('Ｓｈｏｗ  A-Side!'), ['show', 'a', 'side'])
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.search('  !', 10), [])
+        self.assertIsNone(self.index.loaded_at)
+
+    def test_every_word_must_prefix_a_word_of_the_entry(self):
+        self.assertEqual(self.index.search('song', 10), [SONG_TWO, SONG_ONE])
+        self.assertEqual(self.index.search('so on', 10), [SONG_ONE])
+        self.assertEqual(self.index.search('song other', 10), [])
+
+    def test_folders_come_before_songs(self):
+        self.assertEqual(self.index.search('show a', 10), [f'{SHOW_A}/', SONG_TWO, SONG_ONE])
+        self.assertEqual(self.index.search('show', 1), ['index/24-1/Show A/'])
+
+    def test_seasons_song_types_and_lyrics_titles(self):
+        self.assertEqual(self.index.search('winter 2024', 1), ['index/24-1/'])
+        self.assertEqual(self.index.search('summer', 10)[0], 'index/24-3/')
+        self.assertEqual(self.index.search('op1', 10), [SONG_ONE])
+        self.assertEqual(self.index.search('uta', 10), [SONG_ONE])
+        self.assertEqual(self.index.search('歌', 10), [SONG_ONE])
+        # Only songs are indexed, not the other files of a show
+        self.assertEqual(self.index.search('cover', 10), [])
+
+    def test_malformed_song_metadata_is_indexed_by_name(self):
+        self.assertEqual(self.index.search('other', 10), [OTHER])
+
+    def test_refresh_only_reindexes_changes(self):
+        self.index.search('song', 10)
+        self.assertEqual(self.library.metadata_reads, [SHOW_A, SHOW_B])
+
+        del self.library.objects[SONG_TWO]
+        self.library.objects[f'{SHOW_B}/ED FULL Another.mp3'] = '"4"'
+        self.library.metadata_reads.clear()
+        self.index.refresh()
+
+        self.assertEqual(self.index.search('song', 10), [SONG_ONE])
+        self.assertEqual(self.index.search('another', 10), [f'{SHOW_B}/ED FULL Another.mp3'])
+        # Show A's songs and metadata.json did not change, so it was not read again
+        self.assertEqual(self.library.metadata_reads, [SHOW_B])
+        self.assertNotIn('two', self.index.postings)
+
+    def test_stale_index_is_searched_while_it_refreshes_in_the_background(self):
+        self.index.search('song', 10)
+        self.index.ttl = -1
+        del self.library.objects[SONG_TWO]
+        self.library.listing_allowed.clear()
+
+        # Answered from the previous index, while the refresh waits on its listing
+        self.assertEqual(self.index.search('song', 10), [SONG_TWO, SONG_ONE])
+        self.assertEqual(self.index.search('song', 10), [SONG_TWO, SONG_ONE])
+        self.library.listing_allowed.set()
+        self.wait_for_refresh()
+        self.assertEqual(self.index.search('song', 10), [SONG_ONE])
+
+    def test_first_build_failure_propagates(self):
+        self.library.fail = True
+        with self.assertRaises(TransientS3Error):
+            self.index.search('song', 10)
+
+    def test_failed_refresh_keeps_the_previous_index(self):
+        self.index.search('song', 10)
+        self.index.ttl = -1
+        self.library.fail = True
+        self.index.search('song', 10)
+        self.wait_for_refresh()
+        self.assertEqual(self.index.search('song', 10), [SONG_TWO, SONG_ONE])
+
+if __name__ == '__main__':
+    unittest.main()
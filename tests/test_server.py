@@ -0,0 +1,108 @@
+import socket, threading, time, unittest
+from unittest import mock
+
+import server
+from server import PooledHTTPServer, RequestHandler
+
+def failing_chunks():
+    yield b'partial'
+    raise RuntimeError('compression failed')
+
+class ChunkedResponseTest(unittest.TestCase):
+    """Serves one request over a socket pair, with index.handler returning a response of chunks."""
+    def serve(self, request: bytes, chunks) -> tuple[bytes, RequestHandler]:
+        connection, client = socket.socketpair()
+        self.addCleanup(connection.close)
+        self.addCleanup(client.close)
+        handler = RequestHandler(connection, ('test', 0), mock.Mock(stopping=threading.Event()))
+        client.sendall(request)
+
+        response = {'statusCode': 200, 'headers': {'Content-Type': 'text/html'}, 'chunks': chunks}
+        with mock.patch.object(server.index, 'handler', return_value=response), \
+                mock.patch('traceback.print_exc'):
+            handler.close_connection = True
+            handler.handle_one_request()
+        handler.finish()
+        connection.shutdown(socket.SHUT_WR)
+
+        data = b''
+        while received := client.recv(65536):
+            data += received
+        return data, handler
+
+    def test_http_1_1_is_chunked(self):
+        data, handler = self.serve(b'GET /player/index HTTP/1.1\r\nHost: test\r\n\r\n', iter([b'ab', b'', b'cde']))
+        head, _, body = data.partition(b'\r\n\r\n')
+        self.assertIn(b'\r\nTransfer-Encoding: chunked', head)
+        self.assertNotIn(b'Content-Length', head)
+        self.assertEqual(body, b'2\r\nab\r\n3\r\ncde\r\n0\r\n\r\n')
+        self.assertFalse(handler.close_connection)
+
+    def test_http_1_0_gets_a_content_length(self):
+        data, _ = self.serve(b'GET /player/index HTTP/1.0\r\n\r\n', iter([b'ab', b'cde']))
+        head, _, body = data.partition(b'\r\n\r\n')
+        self.assertIn(b'\r\nContent-Length: 5', head)
+        self.assertEqual(body, b'abcde')
+
+    def test_head_has_no_body(self):
+        data, _ = self.serve(b'HEAD /player/index HTTP/1.1\r\nHost: test\r\n\r\n', iter([b'ab']))
+        self.assertTrue(data.endswith(b'\r\n\r\n'))
+        self.assertIn(b'Transfer-Encoding: chunked', data)
+
+    def test_http_1_0_failure_is_a_500(self):
+        data, _ = self.serve(b'GET /player/index HTTP/1.0\r\n\r\n', failing_chunks())
+        self.assertTrue(data.startswith(b'HTTP/1.1 500'))
+        self.assertTrue(data.endswith(b'Internal error.'))
+
+    def test_http_1_1_failure_closes_without_the_last_chunk(self):
+        data, handler = self.serve(b'GET /player/index HTTP/1.1\r\nHost: test\r\n\r\n', failing_chunks())
+        self.assertTrue(data.startswith(b'HTTP/1.1 200'))
+        self.assertTrue(data.endswith(b'7\r\npartial\r\n'))
+        self.assertTrue(handler.close_connection)
+
+class IdleConnectionTest(unittest.TestCase):
+    """Runs a PooledHTTPServer with fewer workers than open connections."""
+    def setUp(self):
+        self.server = PooledHTTPServer(('127.0.0.1', 0), workers=2)
+        self.addCleanup(self.server.server_close)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        response = {'statusCode': 200, 'headers': {'Content-Type': 'text/html'}, 'body': 'page'}
+        patcher = mock.patch.object(server.index, 'handler', return_value=response)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self) -> socket.socket:
+        connection = socket.create_connection(self.server.server_address, timeout=2)
+        self.addCleanup(connection.close)
+        return connection
+
+    def get(self, connection: socket.socket) -> bytes:
+        connection.sendall(b'GET /player/index HTTP/1.1\r\nHost: test\r\n\r\n')
+        data = b''
+        while not data.endswith(b'page'):
+            data += connection.recv(65536)
+        return data
+
+    def test_silent_connections_do_not_take_workers(self):
+        # Like a browser's preconnects, which may never send a request
+        for _ in range(4):
+            self.connect()
+        start = time.monotonic()
+        self.assertTrue(self.get(self.connect()).startswith(b'HTTP/1.1 200'))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_kept_alive_connections_do_not_take_workers(self):
+        idle = [self.connect() for _ in range(4)]
+        for connection in idle:
+            self.get(connection)
+        start = time.monotonic()
+        self.assertTrue(self.get(self.connect()).startswith(b'HTTP/1.1 200'))
+        # And the kept-alive ones still serve their next request
+        self.assertTrue(self.get(idle[0]).startswith(b'HTTP/1.1 200'))
+        self.assertLess(time.monotonic() - start, 1)
+
+if __name__ == '__main__':
+    unittest.main()
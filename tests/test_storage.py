@@ -0,0 +1,90 @@
+import os, tempfile, unittest
+
+from storage import LocalStorage
+from utils import ItemType
+
+class LocalStorageTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.parent = directory.name
+        self.root = os.path.join(self.parent, 'library')
+        for key in (
+            'index/24-1/Show A/OP FULL Song.mp3',
+            'index/24-1/Show A/metadata.json',
+            'index/24-1/b.txt',
+            'index/24-1/a.txt',
+            'index/24-1/Show B/ED FULL Song.mp3',
+            'index/24-1/A Show/OP FULL Song.mp3',
+        ):
+            self.write(os.path.join(self.root, key), '{}')
+        # Outside of the root, next to it
+        self.write(os.path.join(self.parent, 'secret.txt'), 'secret')
+        self.write(os.path.join(self.parent, 'library-other', 'secret.txt'), 'secret')
+        self.storage = LocalStorage(self.root)
+
+    def write(self, path: str, text: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def test_local_path_of_a_key(self):
+        self.assertEqual(
+            self.storage.local_path('index/24-1/a.txt'),
+            os.path.join(os.path.realpath(self.root), 'index', '24-1', 'a.txt'),
+        )
+
+    def test_keys_cannot_leave_the_root(self):
+        for key in (
+            '..',
+            '../secret.txt',
+            'index/../../secret.txt',
+            '../library-other/secret.txt',
+            os.path.join(self.parent, 'secret.txt'),
+            '/etc/passwd',
+        ):
+            with self.subTest(key=key):
+                self.assertIsNone(self.storage.local_path(key))
+                self.assertEqual(self.storage.resolve(key), ItemType.MISSING)
+                self.assertIsNone(self.storage.get_folder(key))
+
+    def test_encoded_dots_are_a_literal_name(self):
+        # Keys arrive unquoted once, so a double-encoded ../ stays a name inside the root
+        local_path = self.storage.local_path('%2e%2e/secret.txt')
+        self.assertEqual(local_path, os.path.join(os.path.realpath(self.root), '%2e%2e', 'secret.txt'))
+        self.assertEqual(self.storage.resolve('%2e%2e/secret.txt'), ItemType.MISSING)
+
+    def test_get_folder_lists_keys_then_prefixes_in_order(self):
+        self.assertEqual(self.storage.get_folder('index/24-1'), [
+            'index/24-1/a.txt',
+            'index/24-1/b.txt',
+            'index/24-1/A Show/',
+            'index/24-1/Show A/',
+            'index/24-1/Show B/',
+        ])
+
+    def test_get_folder_of_a_missing_path_or_a_file(self):
+        self.assertIsNone(self.storage.get_folder('index/24-2'))
+        self.assertIsNone(self.storage.get_folder('index/24-1/a.txt'))
+
+    def test_folder_fingerprint_changes_with_its_files(self):
+        fingerprint = self.storage.get_folder('index/24-1').fingerprint
+        self.assertEqual(self.storage.get_folder('index/24-1').fingerprint, fingerprint)
+        self.write(os.path.join(self.root, 'index/24-1/c.txt'), '')
+        self.assertNotEqual(self.storage.get_folder('index/24-1').fingerprint, fingerprint)
+
+    def test_resolve(self):
+        self.assertEqual(self.storage.resolve('index/24-1/a.txt'), ItemType.FILE)
+        self.assertEqual(self.storage.resolve('index/24-1'), ItemType.FOLDER)
+        self.assertEqual(self.storage.resolve('index/24-1/c.txt'), ItemType.MISSING)
+        self.assertEqual(self.storage.resolve(''), ItemType.MISSING)
+
+    def test_iter_objects(self):
+        self.assertEqual(sorted(key for key, _ in self.storage.iter_objects('index/24-1/Show A/')), [
+            'index/24-1/Show A/OP FULL Song.mp3',
+            'index/24-1/Show A/metadata.json',
+        ])
+        self.assertEqual(list(self.storage.iter_objects('../')), [])
+
+if __name__ == '__main__':
+    unittest.main()
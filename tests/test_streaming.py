@@ -0,0 +1,80 @@
+import os, tempfile, unittest
+
+from streaming import MAX_RANGES, parse_range, stream_file
+
+class ParseRangeTest(unittest.TestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), [(0, 100)])
+        self.assertEqual(parse_range('bytes=500-', 1000), [(500, 500)])
+        self.assertEqual(parse_range('bytes=-200', 1000), [(800, 200)])
+
+    def test_end_past_the_file_is_clamped(self):
+        self.assertEqual(parse_range('bytes=900-5000', 1000), [(900, 100)])
+        self.assertEqual(parse_range('bytes=-5000', 1000), [(0, 1000)])
+
+    def test_several_ranges(self):
+        self.assertEqual(parse_range('bytes=0-0, -1', 10), [(0, 1), (9, 1)])
+
+    def test_unsatisfiable_ranges_are_dropped(self):
+        self.assertEqual(parse_range('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range('bytes=0-9,2000-3000', 1000), [(0, 10)])
+
+    def test_malformed_headers_mean_the_whole_file(self):
+        for header in ('', 'bytes=', 'items=0-1', 'bytes=a-b', 'bytes=5-1', 'bytes=-', 'bytes=0-1;'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_too_many_ranges(self):
+        header = 'bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1))
+        self.assertIsNone(parse_range(header, 1000))
+
+class StreamFileTest(unittest.TestCase):
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(bytes(range(256)) * 4)
+        file.close()
+        self.path = file.name
+        self.stat = os.stat(self.path)
+        self.addCleanup(os.remove, self.path)
+
+    def plan(self, request_headers: dict[str, str]):
+        response_headers: dict[str, str] = {}
+        status, body = stream_file(self.path, self.stat, '"etag"', 'audio/mpeg', request_headers, response_headers)
+        return status, body, response_headers
+
+    def test_whole_file(self):
+        status, body, headers = self.plan({})
+        self.assertEqual(status, 200)
+        self.assertEqual(body.read(), bytes(range(256)) * 4)
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+
+    def test_single_range(self):
+        status, body, headers = self.plan({'range': 'bytes=10-19'})
+        self.assertEqual(status, 206)
+        self.assertEqual(body.read(), bytes(range(10, 20)))
+        self.assertEqual(body.size(), 10)
+        self.assertEqual(headers['Content-Range'], 'bytes 10-19/1024')
+
+    def test_multipart_ranges(self):
+        status, body, headers = self.plan({'range': 'bytes=0-1,-2'})
+        self.assertEqual(status, 206)
+        boundary = headers['Content-Type'].partition('boundary=')[2]
+        data = body.read()
+        self.assertEqual(body.size(), len(data))
+        self.assertIn(b'Content-Range: bytes 0-1/1024\r\n\r\n\x00\x01\r\n', data)
+        self.assertIn(b'Content-Range: bytes 1022-1023/1024\r\n\r\n\xfe\xff\r\n', data)
+        self.assertTrue(data.endswith(f'--{boundary}--\r\n'.encode('ascii')))
+
+    def test_unsatisfiable(self):
+        status, body, headers = self.plan({'range': 'bytes=5000-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'], 'bytes */1024')
+        self.assertEqual(body.size(), 0)
+
+    def test_if_range_of_another_version_sends_the_whole_file(self):
+        status, _, _ = self.plan({'range': 'bytes=0-1', 'if-range': '"other"'})
+        self.assertEqual(status, 200)
+        status, _, _ = self.plan({'range': 'bytes=0-1', 'if-range': '"etag"'})
+        self.assertEqual(status, 206)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from compression import Static
+from templates import Template
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.template = Template('<head>{{ title }}</head><body>{{ content }}</body>')
+
+    def test_render(self):
+        self.assertEqual(
+            self.template.render(title='T', content='C'),
+            '<head>T</head><body>C</body>',
+        )
+
+    def test_parts_keep_segments_static(self):
+        parts = self.template.parts(title='T', content=['A', 'B'])
+        self.assertEqual([part.text if isinstance(part, Static) else part for part in parts], [
+            '<head>', 'T', '</head><body>', 'A', 'B', '</body>',
+        ])
+        self.assertIsInstance(parts[0], Static)
+
+    def test_iter_parts_matches_parts(self):
+        self.assertEqual(
+            list(self.template.iter_parts(title='T', content=['A', lambda: 'B'])),
+            self.template.parts(title='T', content=['A', 'B']),
+        )
+
+    def test_iter_parts_renders_a_slot_when_it_is_reached(self):
+        rendered = []
+        def listing():
+            rendered.append('listing')
+            return 'L'
+
+        parts = self.template.iter_parts(title='T', content=['A', listing])
+        for _ in range(4):
+            next(parts)
+        self.assertEqual(rendered, [])
+        self.assertEqual(next(parts), 'L')
+        self.assertEqual(rendered, ['listing'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import io, json, threading, time, unittest
+from unittest import mock
+
+import utils
+from utils import Metadata, NotModified, SingleFlight, TransientS3Error
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight('test_flight', timeout=5)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_call(self):
+        self.calls += 1
+        self.release.wait(5)
+        return 'result'
+
+    def start_waiters(self, key, count: int, call) -> tuple[list[threading.Thread], list]:
+        """Starts a leader and `count - 1` waiters, and returns once all of them are in the flight."""
+        outcomes = []
+
+        def run():
+            try:
+                outcomes.append(self.flights.do(key, call))
+            except Exception as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.flights.coalesced < count - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return threads, outcomes
+
+    def test_concurrent_calls_share_one_call(self):
+        threads, outcomes = self.start_waiters('key', 8, self.slow_call)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outcomes, ['result'] * 8)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.stats(), {'calls': 1, 'coalesced': 7, 'in_flight': 0})
+
+    def test_finished_calls_are_not_shared(self):
+        self.release.set()
+        self.flights.do('key', self.slow_call)
+        self.flights.do('key', self.slow_call)
+        self.flights.do('other key', self.slow_call)
+        self.assertEqual(self.calls, 3)
+
+    def test_each_waiter_raises_its_own_copy_of_the_error(self):
+        def failing_call():
+            self.release.wait(5)
+            raise TransientS3Error('get_object failed')
+
+        threads, outcomes = self.start_waiters('key', 4, failing_call)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(isinstance(error, TransientS3Error) for error in outcomes))
+        self.assertEqual(len({id(error) for error in outcomes}), 4)
+        leader_errors = [error for error in outcomes if error.__cause__ is None]
+        self.assertEqual(len(leader_errors), 1)
+        for error in outcomes:
+            self.assertEqual(str(error), 'get_object failed')
+            if error is not leader_errors[0]:
+                self.assertIs(error.__cause__, leader_errors[0])
+
+    def test_waiters_time_out(self):
+        leader = threading.Thread(target=self.flights.do, args=('key', self.slow_call))
+        leader.start()
+        while not self.flights.flights:
+            time.sleep(0.001)
+        with self.assertRaises(TransientS3Error):
+            self.flights.do('key', self.slow_call, timeout=0.01)
+        self.release.set()
+        leader.join()
+        self.assertEqual(self.calls, 1)
+
+class MetadataTest(unittest.TestCase):
+    def test_links_songs_and_lyrics(self):
+        metadata = Metadata({
+            'folderMetadata': {'previousSeason': '23-4/Show', 'nextCour': '24-3/Show'},
+            'addSongs': ['index/23-4/Show/OP FULL Song.mp3'],
+            'songMetadata': {
+                'Song': {'lyrics': {'kanji': {'title': '歌', 'lines': []}}},
+                'No Lyrics': {},
+            },
+        })
+        self.assertEqual(metadata.links, [('Season', '23-4/Show', None), ('Cour', None, '24-3/Show')])
+        self.assertEqual(metadata.add_songs, ['index/23-4/Show/OP FULL Song.mp3'])
+        self.assertEqual(metadata.lyrics, {'Song': {'title': '歌', 'lines': []}})
+
+    def test_malformed_entries_only_lose_themselves(self):
+        metadata = Metadata({
+            'folderMetadata': ['not', 'an', 'object'],
+            'songMetadata': {
+                'Song': {'lyrics': {'kanji': {'title': '歌'}}},
+                'String': 'malformed',
+                'Null': None,
+                'List Lyrics': {'lyrics': ['malformed']},
+            },
+        })
+        self.assertEqual(metadata.links, [])
+        self.assertEqual(metadata.lyrics, {'Song': {'title': '歌'}})
+        self.assertEqual(Metadata({'songMetadata': ['malformed']}).lyrics, {})
+
+class MetadataCacheTest(unittest.TestCase):
+    """load_s3_metadata against a bucket of one metadata.json."""
+    def setUp(self):
+        self.body: bytes | None = json.dumps({'addSongs': ['a.mp3']}).encode('utf-8')
+        self.etag = '"1"'
+        self.requests: list[dict] = []
+        utils.metadata_cache.clear()
+        self.addCleanup(utils.metadata_cache.clear)
+        patcher = mock.patch.object(utils, 'call_s3', self.call_s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call_s3(self, operation: str, **kwargs):
+        self.requests.append(kwargs)
+        if self.body is None:
+            return None
+        if kwargs.get('IfNoneMatch') == self.etag:
+            raise NotModified(operation)
+        return {'Body': io.BytesIO(self.body), 'ETag': self.etag}
+
+    def test_unchanged_file_is_reused(self):
+        first = utils.load_s3_metadata('index/24-1/Show')
+        second = utils.load_s3_metadata('index/24-1/Show')
+        self.assertIs(second, first)
+        self.assertEqual(first.add_songs, ['a.mp3'])
+        self.assertEqual(self.requests[1].get('IfNoneMatch'), '"1"')
+
+    def test_changed_file_is_parsed_again(self):
+        utils.load_s3_metadata('index/24-1/Show')
+        self.body, self.etag = json.dumps({'addSongs': ['b.mp3']}).encode('utf-8'), '"2"'
+        metadata = utils.load_s3_metadata('index/24-1/Show')
+        self.assertEqual((metadata.add_songs, metadata.etag), (['b.mp3'], '"2"'))
+
+    def test_deleted_or_invalid_file_leaves_the_cache(self):
+        utils.load_s3_metadata('index/24-1/Show')
+        self.body = None
+        self.assertIsNone(utils.load_s3_metadata('index/24-1/Show'))
+        self.assertIsNone(utils.metadata_cache.get('index/24-1/Show'))
+
+        self.body, self.etag = b'{', '"3"'
+        self.assertIsNone(utils.load_s3_metadata('index/24-1/Show'))
+        self.assertIsNone(utils.metadata_cache.get('index/24-1/Show'))
+        self.assertNotIn('IfNoneMatch', self.requests[-1])
+
+if __name__ == '__main__':
+    unittest.main()
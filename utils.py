@@ -1,26 +1,345 @@
-import os.path, urllib.parse
+import os.path, urllib.parse, json, time, hashlib, re, contextvars, copy, threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from enum import Enum
+from typing import Any, Callable, Hashable, Iterator, TypeVar
 
-from env import BUCKET, s3_client
+from env import (
+    BUCKET, S3_WORKERS, RESOLVE_TTL, MISSING_TTL, RESOLVE_CACHE_SIZE,
+    PRESIGN_WINDOW, PRESIGN_CACHE_SIZE, SINGLE_FLIGHT_TIMEOUT, METADATA_CACHE_SIZE, get_s3_client,
+)
+from cache import LRUCache
+import metrics
 
 season_map = {1: "Winter", 2: "Spring", 3: "Summer", 4: "Fall"}
 re_season = r"(\d{2})-(1|2|3|4)"
 
-def get_s3_folder(path):
+missing_error_codes = {'404', 'NoSuchKey', 'NotFound'}
+not_modified_error_codes = {'304', 'NotModified'}
+
+class ItemType(Enum):
+    UNKNOWN = 0
+    FOLDER = 1
+    FILE = 2
+    MISSING = 3
+
+class TransientS3Error(Exception):
+    """An S3 call failed for a reason other than the key not existing."""
+
+class NotModified(Exception):
+    """A conditional S3 call matched the ETag it was given."""
+
+T = TypeVar('T')
+
+class Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+class SingleFlight:
+    """
+    Shares one in-flight call per key between the threads that ask for the
+    same key at the same time: the first runs the call, and the others wait
+    for its result or exception. Each waiter raises its own copy of the
+    exception, chained to the leader's. Waiters give up after `timeout`
+    seconds with TransientS3Error, while the call itself carries on.
+    """
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self.flights: dict[Hashable, Flight] = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, call: Callable[[], T], timeout: float | None = None) -> T:
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                flight.result = call()
+                return flight.result
+            except BaseException as error:
+                flight.error = error
+                raise
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+
+        metrics.count(f'{self.name}.coalesced')
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            raise TransientS3Error(f'Timed out waiting for {self.name} {key}')
+        if (error := flight.error) is not None:
+            try:
+                waiter_error = copy.copy(error)
+            except Exception:
+                waiter_error = TransientS3Error(f'{self.name} {key} failed: {error}')
+            raise waiter_error from error
+        return flight.result
+
+    def stats(self) -> dict[str, int]:
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self.flights)}
+
+# Concurrent requests for the same listing, path resolution or metadata.json share one S3 call
+s3_flights = SingleFlight('s3_flight', SINGLE_FLIGHT_TIMEOUT)
+
+def call_s3(operation: str, **kwargs) -> dict[str, Any] | None:
+    """
+    Calls an S3 client operation on the player bucket. Returns None when the
+    key does not exist, raises NotModified when an `IfNoneMatch` ETag matched,
+    and raises TransientS3Error for any other failure, so that throttling or
+    network errors are never mistaken for a missing key.
+    """
+    client = get_s3_client()
+    # Already loaded by the client
+    from botocore.exceptions import BotoCoreError, ClientError
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=path + '/', Delimiter='/')
-        if response['KeyCount'] == 0:
-            # Empty / non-existent folder
+        with metrics.span(f's3.{operation}'):
+            return getattr(client, operation)(Bucket=BUCKET, **kwargs)
+    except ClientError as error:
+        code = error.response.get('Error', {}).get('Code')
+        if code in missing_error_codes:
             return None
-        return response
-    except:
+        if code in not_modified_error_codes:
+            raise NotModified(operation) from error
+        raise TransientS3Error(f'{operation} failed: {error}') from error
+    except BotoCoreError as error:
+        raise TransientS3Error(f'{operation} failed: {error}') from error
+
+def iter_s3_listing(prefix: str, delimiter: str | None = '/') -> Iterator[dict[str, Any]]:
+    """
+    Yields each page of a listing, following continuation tokens past the
+    1000 keys that a single list_objects_v2 call returns.
+    """
+    kwargs: dict[str, Any] = {'Prefix': prefix}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+    while response := call_s3('list_objects_v2', **kwargs):
+        yield response
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+class FolderListing(list[str]):
+    """A folder's keys and sub-folder prefixes, with a fingerprint of their ETags."""
+    fingerprint = ''
+
+class Metadata(dict[str, Any]):
+    """
+    A parsed metadata.json, with its ETag and the parts that pages read
+    resolved once: the folder's previous/next links, the songs it adds, and
+    each song's lyrics by song name.
+    """
+    etag = ''
+    # Bytes of the file, for the metadata cache
+    size = 0
+
+    def __init__(self, data: dict[str, Any]):
+        super().__init__(data)
+        folder_data: dict[str, Any] = self.get('folderMetadata') or {}
+        if not isinstance(folder_data, dict):
+            folder_data = {}
+        # (kind, previous, next) for each kind of link that the folder has, e.g. ('Cour', None, '24-3/Show')
+        self.links: list[tuple[str, str | None, str | None]] = [
+            (kind, folder_data.get(f'previous{kind}'), folder_data.get(f'next{kind}'))
+            for kind in ('Season', 'Cour', 'SplitCour')
+            if f'previous{kind}' in folder_data or f'next{kind}' in folder_data
+        ]
+        self.add_songs: list[str] = self.get('addSongs') or []
+        # song name -> kanji lyrics, for songs that have them. A malformed
+        # song entry only loses its own lyrics, not the folder's metadata.
+        song_metadata = self.get('songMetadata')
+        self.lyrics: dict[str, dict[str, Any]] = {
+            name: kanji for name, song in (song_metadata.items() if isinstance(song_metadata, dict) else [])
+            if isinstance(song, dict)
+            and isinstance(lyrics := song.get('lyrics'), dict)
+            and (kanji := lyrics.get('kanji'))
+        }
+
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def iter_s3_folder(path: str) -> Iterator[tuple[str, str]]:
+    """
+    Yields the (key, ETag) of each object and (prefix, '') of each sub-folder
+    as each page of the folder's listing arrives.
+    """
+    for response in iter_s3_listing(path + '/'):
+        for obj in response.get('Contents', []):
+            yield obj['Key'], obj['ETag']
+        for folder in response.get('CommonPrefixes', []):
+            yield folder['Prefix'], ''
+
+def get_s3_folder(path) -> FolderListing | None:
+    """
+    Returns the folder's keys and prefixes, or None for an empty / non-existent
+    folder. The whole listing is collected, as its fingerprint is needed
+    before rendering, but only the keys are kept from each page: memory grows
+    with the number of keys, not with the pages' response data.
+    """
+    return s3_flights.do(('folder', path), partial(load_s3_folder, path))
+
+def load_s3_folder(path) -> FolderListing | None:
+    listing = FolderListing()
+    # The same digest as fingerprint(key, etag, ...), without keeping the ETags
+    digest = hashlib.blake2b(digest_size=12)
+    for key, etag in iter_s3_folder(path):
+        listing.append(key)
+        digest.update(f'{key}\0{etag}\0'.encode('utf-8'))
+    if not listing:
+        return None
+    listing.fingerprint = digest.hexdigest()
+    return listing
+
+def get_s3_metadata(path) -> Metadata | None:
+    return s3_flights.do(('metadata', path), partial(load_s3_metadata, path))
+
+# folder path -> its parsed metadata.json
+metadata_cache = LRUCache(METADATA_CACHE_SIZE, sizeof=lambda metadata: metadata.size)
+
+def load_s3_metadata(path) -> Metadata | None:
+    """
+    Reads a folder's metadata.json, or reuses the parsed copy from the last
+    read when a conditional GET finds that its ETag is unchanged.
+    """
+    kwargs: dict[str, Any] = {'Key': f'{path}/metadata.json'}
+    if (cached := metadata_cache.get(path)) is not None:
+        kwargs['IfNoneMatch'] = cached.etag
+    try:
+        response = call_s3('get_object', **kwargs)
+    except NotModified:
+        metrics.count('metadata_cache.hit')
+        return cached
+    metrics.count('metadata_cache.miss')
+    if not response:
+        metadata_cache.delete(path)
         return None
 
-def s3_file_exists(path) -> bool:
+    body = response['Body'].read()
     try:
-        s3_client.head_object(Bucket=BUCKET, Key=path)
-        return True
-    except:
-        return False
+        metadata = Metadata(json.loads(body))
+    except ValueError:
+        metadata_cache.delete(path)
+        return None
+    metadata.etag = response['ETag']
+    metadata.size = len(body)
+    metadata_cache.set(path, metadata)
+    return metadata
+
+# path -> (item type, monotonic expiry)
+resolved_paths = LRUCache(RESOLVE_CACHE_SIZE, sizeof=lambda _: 1)
+
+def resolve_path(path: str) -> ItemType:
+    """
+    Decides whether a path is a file, a folder or missing from a single listing
+    of the path as a prefix. Results are cached, with missing paths expiring
+    sooner. TransientS3Error propagates and is not cached.
+    """
+    now = time.monotonic()
+    if (cached := resolved_paths.get(path)) and cached[1] > now:
+        metrics.count('resolve_cache.hit')
+        return cached[0]
+    metrics.count('resolve_cache.miss')
+
+    item_type = s3_flights.do(('resolve', path), partial(load_item_type, path)) if path else ItemType.MISSING
+
+    ttl = MISSING_TTL if item_type == ItemType.MISSING else RESOLVE_TTL
+    resolved_paths.set(path, (item_type, now + ttl))
+    return item_type
+
+def load_item_type(path: str) -> ItemType:
+    folder_prefix = path + '/'
+    for response in iter_s3_listing(path):
+        if any(obj['Key'] == path for obj in response.get('Contents', [])):
+            return ItemType.FILE
+        if any(folder['Prefix'] == folder_prefix for folder in response.get('CommonPrefixes', [])):
+            return ItemType.FOLDER
+    return ItemType.MISSING
+
+# (bucket, key) -> URL, versioned by presign window
+presigned_urls = LRUCache(PRESIGN_CACHE_SIZE)
+
+def presign_window() -> int:
+    return int(time.time()) // PRESIGN_WINDOW
+
+def get_presigned_url(key: str, window: int | None = None) -> str:
+    """
+    Returns a presigned GET URL that is identical for every request in the same
+    PRESIGN_WINDOW, so that browsers can cache the audio across replays. It
+    expires one full window after the window it was issued in ends.
+    """
+    if window is None:
+        window = presign_window()
+    if (url := presigned_urls.get((BUCKET, key), window)) is not None:
+        metrics.count('presign_cache.hit')
+        return url
+    metrics.count('presign_cache.miss')
+
+    expires_in = (window + 2) * PRESIGN_WINDOW - int(time.time())
+    with metrics.span('s3.presign'):
+        url = get_s3_client().generate_presigned_url(
+            ClientMethod='get_object',
+            Params={
+                'Bucket': BUCKET,
+                'Key': key,
+                # The URL never points at different content, so the response is cacheable until it expires
+                'ResponseCacheControl': f'private, max-age={expires_in}, immutable',
+            },
+            ExpiresIn=expires_in,
+        )
+    presigned_urls.set((BUCKET, key), url, window)
+    return url
+
+def get_presigned_urls(keys: list[str], window: int | None = None) -> list[str]:
+    """Presigns several keys for the same window, so that they expire together."""
+    if window is None:
+        window = presign_window()
+    return [get_presigned_url(key, window) for key in keys]
+
+# boto3 clients are thread-safe, so the workers share the client's connection pool
+executor = ThreadPoolExecutor(max_workers=S3_WORKERS, thread_name_prefix='s3')
+
+def run_concurrently(*calls: Callable[[], Any]) -> list[Any]:
+    """
+    Runs independent S3 calls on the shared executor and returns their results
+    in order, so that the total latency is that of the slowest call. Each call
+    runs in a copy of the caller's context, so that it is timed with its request.
+    """
+    futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
+
+def get_song_name(path: str) -> str:
+    name = os.path.basename(os.path.splitext(path)[0])\
+        .replace('OP ', '')\
+        .replace('ED ', '')
+    return re.sub(r"(\d+ )?FULL ?", '', name)
+
+re_plain_name = re.compile(r"[\w.~ -]*", re.ASCII)
+
+@lru_cache(maxsize=1024)
+def quote_folder(path: str) -> str:
+    return urllib.parse.quote(path)
+
+def quote_name(name: str) -> str:
+    # Spaces are the only character to quote in most names
+    if re_plain_name.fullmatch(name):
+        return name.replace(' ', '%20')
+    return urllib.parse.quote(name)
 
 def encode_path_components(path: str):
     """
@@ -28,6 +347,15 @@ def encode_path_components(path: str):
     a list of the quoted components.
     """
     is_folder = path.endswith('/')
+    trimmed = path[:-1] if is_folder else path
+    # Paths that normpath would leave unchanged skip it. Siblings share their
+    # quoted folder, so only the last component is quoted for each of them.
+    if trimmed and trimmed[0] != '.' and '//' not in trimmed and '/.' not in trimmed:
+        folder, slash, name = trimmed.rpartition('/')
+        return ''.join([
+            quote_folder(folder), slash, quote_name(name), '/' if is_folder else '',
+        ])
+
     normalized_path = os.path.normpath(path)
     components = normalized_path.split(os.path.sep)
     quoted_components = [urllib.parse.quote(component) for component in components]